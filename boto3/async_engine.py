@@ -0,0 +1,76 @@
+"""Clients for the provisioning coroutines.
+
+Every helper and step in iac-deployment.py is a coroutine that awaits its AWS
+calls. The default engine hands them boto3 clients wrapped in
+``clients.ThreadedClient``, which runs each call on a shared thread pool; the
+``async`` engine hands them aiobotocore clients, so describes, polls and
+waiters for many environments are all in flight on one event loop without a
+thread each.
+"""
+from contextlib import AsyncExitStack, asynccontextmanager
+
+from botocore.config import Config
+
+try:
+    from aiobotocore.session import get_session
+except ImportError:
+    get_session = None
+
+from clients import client_options, get_threaded_client
+from ratelimit import rate_limiter
+
+SERVICES = ('ec2', 'elbv2', 'autoscaling')
+ENGINES = ('threads', 'async')
+
+
+class AsyncClients:
+    """Opens one aiobotocore client per service for the lifetime of the
+    ``async with`` block, sharing the rate limiter's buckets with every
+    other client."""
+
+    def __init__(self, profile, region, services=SERVICES, endpoint_url=None):
+        if get_session is None:
+            raise RuntimeError("The asyncio engine needs aiobotocore: pip install aiobotocore")
+        self.profile = profile
+        self.region = region
+        self.services = services
+        self.endpoint_url = endpoint_url
+        self.clients = {}
+        self._stack = AsyncExitStack()
+
+    async def __aenter__(self):
+        session = get_session()
+        if self.profile:
+            session.set_config_variable('profile', self.profile)
+        for service in self.services:
+            client = await self._stack.enter_async_context(session.create_client(
+                service, region_name=self.region, endpoint_url=self.endpoint_url, config=Config(**client_options)
+            ))
+            rate_limiter.attach(client, asynchronous=True)
+            self.clients[service] = client
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._stack.aclose()
+
+    def __getitem__(self, service):
+        return self.clients[service]
+
+
+@asynccontextmanager
+async def open_clients(configs, engine='threads'):
+    """``{name: {service: client}}`` for every config, with clients from
+    ``engine``. Targets in the same region and profile share clients."""
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine!r}, expected one of {', '.join(ENGINES)}")
+    async with AsyncExitStack() as stack:
+        shared = {}
+        for config in configs:
+            key = (config['profile'], config['region'])
+            if key in shared:
+                continue
+            if engine == 'async':
+                shared[key] = (await stack.enter_async_context(AsyncClients(*key))).clients
+            else:
+                shared[key] = {service: get_threaded_client(service, *key) for service in SERVICES}
+        yield {config['name']: shared[(config['profile'], config['region'])] for config in configs}
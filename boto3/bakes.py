@@ -0,0 +1,124 @@
+import asyncio
+import hashlib
+from datetime import datetime, timedelta, timezone
+
+from botocore.exceptions import ClientError
+
+from batching import tag_specifications
+from inventory import LIVE_INSTANCE_STATES, tag_value
+from lookups import collect, iter_images, iter_instances, iter_launch_template_versions
+
+BAKE_FAMILY_TAG = 'mern:bake-family'
+BAKE_HASH_TAG = 'mern:bake-hash'
+BASE_AMI_TAG = 'mern:base-ami'
+USABLE_IMAGE_STATES = ('available', 'pending')
+
+
+def bake_hash(user_data, base_ami_id, instance_type):
+    """Fingerprint of everything that goes into a baked AMI."""
+    digest = hashlib.sha256()
+    for part in (user_data or '', base_ami_id, instance_type):
+        digest.update(part if isinstance(part, bytes) else part.encode())
+        digest.update(b'\0')
+    return digest.hexdigest()[:16]
+
+
+def bake_name(family, digest):
+    # AMI names are unique per account and region, so every bake gets its own.
+    return f'{family}-{digest}'
+
+
+def bake_tags(family, digest, base_ami_id):
+    return {BAKE_FAMILY_TAG: family, BAKE_HASH_TAG: digest, BASE_AMI_TAG: base_ami_id}
+
+
+def bake_tag_specifications(family, digest, base_ami_id, tags=None):
+    tags = dict(bake_tags(family, digest, base_ami_id), **(tags or {}))
+    return tag_specifications('image', bake_name(family, digest), tags)
+
+
+async def list_bakes(ec2_client, family, inventory=None):
+    if inventory is not None:
+        return [image for image in inventory.resources['images'] if tag_value(image, BAKE_FAMILY_TAG) == family]
+    return await collect(iter_images(ec2_client, [{'Name': f'tag:{BAKE_FAMILY_TAG}', 'Values': [family]}],
+                                     owners=['self']))
+
+
+async def find_bake(ec2_client, family, digest, inventory=None):
+    for image in await list_bakes(ec2_client, family, inventory):
+        if tag_value(image, BAKE_HASH_TAG) == digest and image.get('State', 'available') in USABLE_IMAGE_STATES:
+            return image
+    return None
+
+
+def matches_bake(image, user_data, instance_type):
+    """True if ``image`` was baked from ``user_data`` and ``instance_type``
+    on the base AMI it is tagged with, and is not a failed bake."""
+    base_ami_id = tag_value(image, BASE_AMI_TAG)
+    return (base_ami_id is not None and image.get('State', 'available') in USABLE_IMAGE_STATES
+            and tag_value(image, BAKE_HASH_TAG) == bake_hash(user_data, base_ami_id, instance_type))
+
+
+def _created(image):
+    created = image.get('CreationDate')
+    if not created:
+        return datetime.now(timezone.utc)
+    return datetime.fromisoformat(created.replace('Z', '+00:00'))
+
+
+async def delete_image(ec2_client, image):
+    """Deregister ``image`` and delete the snapshots behind it."""
+    await ec2_client.deregister_image(ImageId=image['ImageId'])
+    await asyncio.gather(*(ec2_client.delete_snapshot(SnapshotId=mapping['Ebs']['SnapshotId'])
+                           for mapping in image.get('BlockDeviceMappings') or []
+                           if mapping.get('Ebs', {}).get('SnapshotId')))
+
+
+def expired_bakes(images, keep=3, max_age_days=30, protect=(), now=None):
+    """Bakes beyond the ``keep`` newest, or older than ``max_age_days``.
+    Images in ``protect`` are never returned."""
+    now = now or datetime.now(timezone.utc)
+    ordered = sorted(images, key=_created, reverse=True)
+    cutoff = now - timedelta(days=max_age_days)
+    return [image for index, image in enumerate(ordered)
+            if image['ImageId'] not in protect and (index >= keep or _created(image) < cutoff)]
+
+
+async def images_in_use(ec2_client, image_ids, launch_template_name=None):
+    """The ids in ``image_ids`` that a version of the launch template or a
+    live instance still refers to."""
+    image_ids = set(image_ids)
+    if not image_ids:
+        return set()
+    in_use = set()
+    if launch_template_name:
+        async for version in iter_launch_template_versions(ec2_client, launch_template_name):
+            in_use.add(version.get('LaunchTemplateData', {}).get('ImageId'))
+    async for instance in iter_instances(ec2_client, [
+        {'Name': 'image-id', 'Values': sorted(image_ids)},
+        {'Name': 'instance-state-name', 'Values': LIVE_INSTANCE_STATES},
+    ]):
+        in_use.add(instance['ImageId'])
+    return in_use & image_ids
+
+
+async def collect_bakes(ec2_client, family, keep=3, max_age_days=30, protect=(), launch_template_name=None):
+    """Deregister expired bakes of ``family`` and delete their snapshots.
+    Bakes that a version of ``launch_template_name`` or a live instance still
+    refers to are kept, so a rollback always has its image. Returns the ids
+    of the deregistered images."""
+    removed = []
+    try:
+        images = await list_bakes(ec2_client, family)
+        expired = expired_bakes(images, keep, max_age_days, protect)
+        in_use = await images_in_use(ec2_client, [image['ImageId'] for image in expired], launch_template_name)
+        for image in expired:
+            if image['ImageId'] in in_use:
+                print(f"Keeping old bake {image['ImageId']} ({image.get('Name')}), it is still in use")
+                continue
+            await delete_image(ec2_client, image)
+            print(f"Deregistered old bake {image['ImageId']} ({image.get('Name')})")
+            removed.append(image['ImageId'])
+    except ClientError as e:
+        print(f"An error occurred while collecting old bakes: {e}")
+    return removed
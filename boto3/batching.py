@@ -0,0 +1,72 @@
+import threading
+
+
+class CallSavings:
+    """Counts, per operation, the API calls made next to the number the
+    one-call-per-item version would have needed."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = {}
+
+    def record(self, operation, made, unbatched):
+        with self._lock:
+            counts = self.calls.setdefault(operation, [0, 0])
+            counts[0] += made
+            counts[1] += unbatched
+
+    def saved(self):
+        with self._lock:
+            return sum(unbatched - made for made, unbatched in self.calls.values())
+
+    def report(self):
+        if not self.calls:
+            return
+        print(f"Batching saved {self.saved()} API calls:")
+        for operation, (made, unbatched) in sorted(self.calls.items()):
+            print(f"  {operation}: {made} call(s) instead of {unbatched}")
+
+
+call_savings = CallSavings()
+
+
+def tag_list(tags):
+    return [{'Key': key, 'Value': value} for key, value in (tags or {}).items()]
+
+
+def tag_specifications(resource_type, name, tags=None):
+    return [{'ResourceType': resource_type, 'Tags': tag_list(dict({'Name': name}, **(tags or {})))}]
+
+
+def ip_permissions(ports, cidr='0.0.0.0/0'):
+    return [
+        {
+            'IpProtocol': 'tcp',
+            'FromPort': port,
+            'ToPort': port,
+            'IpRanges': [{'CidrIp': cidr}]
+        }
+        for port in sorted(port for port in ports if port is not None)
+    ]
+
+
+async def authorize_ports(ec2_client, sg_id, ports):
+    permissions = ip_permissions(ports)
+    if permissions:
+        await ec2_client.authorize_security_group_ingress(GroupId=sg_id, IpPermissions=permissions)
+        call_savings.record('authorize_security_group_ingress', 1, len(permissions))
+
+
+async def revoke_ports(ec2_client, sg_id, ports):
+    permissions = ip_permissions(ports)
+    if permissions:
+        await ec2_client.revoke_security_group_ingress(GroupId=sg_id, IpPermissions=permissions)
+        call_savings.record('revoke_security_group_ingress', 1, len(permissions))
+
+
+async def register_targets(elbv2_client, target_group_arn, instance_ids):
+    targets = [{'Id': instance_id} for instance_id in dict.fromkeys(instance_ids) if instance_id]
+    if targets:
+        await elbv2_client.register_targets(TargetGroupArn=target_group_arn, Targets=targets)
+        call_savings.record('register_targets', 1, len(targets))
+    return [target['Id'] for target in targets]
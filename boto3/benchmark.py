@@ -0,0 +1,282 @@
+"""Offline benchmark for the provisioning flow.
+
+Runs iac-deployment.py against moto's in-process AWS with injected per-call
+latency and throttling, and reports wall-clock, API call counts and per-step
+p50/p95 for a few scenarios. Results are appended to a JSON lines file so
+runs can be compared over time:
+
+    pip install "moto[ec2,elbv2,autoscaling]"
+    python benchmark.py --latency 200 --jitter 50 --throttle-rate 0.02 --compare
+"""
+import argparse
+import asyncio
+import importlib.util
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+
+from botocore.awsrequest import AWSResponse
+
+import clients as client_factory
+from loadtest import percentile
+from tracing import tracer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REGION = 'ap-northeast-3'
+SCENARIOS = ('cold', 'noop', 'noop-cached', 'partial')
+
+BASE_IMAGE = {
+    'ami_id': 'ami-0b3a5e1ab5e000000',
+    'name': 'ubuntu/images/hvm-ssd/ubuntu-jammy-22.04-amd64-server-20240411',
+    'description': 'Canonical, Ubuntu, 22.04 LTS, amd64 jammy image',
+    'owner_id': '099720109477',
+    'architecture': 'x86_64',
+    'hypervisor': 'xen',
+    'image_type': 'machine',
+    'platform': None,
+    'public': True,
+    'root_device_name': '/dev/sda1',
+    'root_device_type': 'ebs',
+    'sriov': 'simple',
+    'state': 'available',
+    'tags': {},
+    'virtualization_type': 'hvm',
+}
+
+THROTTLE_RESPONSES = {
+    'ec2': (503, b'<Response><Errors><Error><Code>RequestLimitExceeded</Code>'
+                 b'<Message>Request limit exceeded.</Message></Error></Errors>'
+                 b'<RequestID>benchmark</RequestID></Response>'),
+    'query': (400, b'<ErrorResponse><Error><Type>Sender</Type><Code>Throttling</Code>'
+                   b'<Message>Rate exceeded</Message></Error>'
+                   b'<RequestId>benchmark</RequestId></ErrorResponse>'),
+}
+
+
+class _Body:
+
+    def __init__(self, content):
+        self.content = content
+
+    def stream(self, **kwargs):
+        yield self.content
+
+
+def load_deployment():
+    spec = importlib.util.spec_from_file_location('iac_deployment', os.path.join(HERE, 'iac-deployment.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def inject_faults(client, latency, jitter, throttle_rate, rng):
+    protocol = 'ec2' if client.meta.service_model.protocol == 'ec2' else 'query'
+    status, body = THROTTLE_RESPONSES[protocol]
+
+    def before_send(request, **kwargs):
+        time.sleep(max(0.0, latency + rng.uniform(-jitter, jitter)))
+        if throttle_rate and rng.random() < throttle_rate:
+            # Point the request somewhere moto does not serve so the throttled
+            # call is not executed behind the injected response.
+            request.url = 'https://throttled.benchmark.invalid/'
+            return AWSResponse(request.url, status, {}, _Body(body))
+
+    client.meta.events.register_first('before-send.*.*', before_send)
+
+
+def benchmark_config(deployment, workdir):
+    config = deployment.default_config()
+    config.update({
+        'profile': None,
+        'region': REGION,
+        'inventory_cache': os.path.join(workdir, f'.inventory-{REGION}.json'),
+        'readiness': {'timeout': 60, 'health_ports': (), 'check_marker': False},
+        # moto never runs user data, so any script will do.
+        'user_data': '#!/bin/bash\n',
+        # Nor does it serve HTTP for the load balancer.
+        'load_test_settings': None,
+    })
+    return config
+
+
+def prepare_partial(deployment, config):
+    ec2_client = client_factory.get_threaded_client('ec2', config['profile'], config['region'])
+
+    async def prepare():
+        network = await deployment.create_vpc(ec2_client, config['availability_zones'])
+        await deployment.create_security_group(ec2_client, network.vpc_id)
+
+    asyncio.run(prepare())
+
+
+def run_scenario(deployment, mock_aws, scenario, options, rng):
+    with tempfile.TemporaryDirectory() as workdir, mock_aws():
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            client_factory.clear_cache()
+            config = benchmark_config(deployment, workdir)
+            for service in ('ec2', 'elbv2', 'autoscaling'):
+                client = client_factory.get_client(service, config['profile'], config['region'])
+                inject_faults(client, options.latency / 1000, options.jitter / 1000, options.throttle_rate, rng)
+
+            with redirect_stdout(io.StringIO() if not options.verbose else sys.stdout):
+                if scenario == 'noop':
+                    deployment.run(config)
+                elif scenario == 'noop-cached':
+                    # The second run changes nothing, so it leaves a fresh
+                    # inventory cache behind for the measured run.
+                    deployment.run(config)
+                    deployment.run(config)
+                elif scenario == 'partial':
+                    prepare_partial(deployment, config)
+
+                tracer.reset()
+                start = time.monotonic()
+                ok = deployment.run(config, refresh=scenario != 'noop-cached')
+                wall = time.monotonic() - start
+        finally:
+            os.chdir(cwd)
+            client_factory.clear_cache()
+
+    return {
+        'ok': ok,
+        'wall': wall,
+        'calls': len(tracer.calls),
+        'throttles': sum(call['throttles'] for call in tracer.calls),
+        'steps': {span['name']: span['duration'] for span in tracer.spans if span['category'] == 'step'},
+    }
+
+
+def summarize(runs):
+    steps = {}
+    for run in runs:
+        for name, duration in run['steps'].items():
+            steps.setdefault(name, []).append(duration)
+    walls = [run['wall'] for run in runs]
+    return {
+        'iterations': len(runs),
+        'failures': sum(1 for run in runs if not run['ok']),
+        'wall_p50': percentile(walls, 50),
+        'wall_p95': percentile(walls, 95),
+        'calls': percentile([run['calls'] for run in runs], 50),
+        'throttles': sum(run['throttles'] for run in runs),
+        'steps': {name: {'p50': percentile(durations, 50), 'p95': percentile(durations, 95)}
+                  for name, durations in steps.items()},
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results):
+    for scenario, summary in results.items():
+        print(f"{scenario}: wall p50 {summary['wall_p50']:.2f}s p95 {summary['wall_p95']:.2f}s, "
+              f"{summary['calls']} API calls, {summary['throttles']} throttled, "
+              f"{summary['failures']}/{summary['iterations']} failed")
+        for name, timing in sorted(summary['steps'].items(), key=lambda item: item[1]['p50'], reverse=True):
+            print(f"  {name:<32}p50 {timing['p50']:>7.2f}s  p95 {timing['p95']:>7.2f}s")
+
+
+def previous_result(path, params):
+    previous = None
+    try:
+        with open(path) as results_file:
+            for line in results_file:
+                record = json.loads(line)
+                if record.get('params') == params:
+                    previous = record
+    except (OSError, ValueError):
+        return None
+    return previous
+
+
+def print_comparison(previous, results):
+    print(f"Compared with {previous['revision'] or 'unknown revision'} from {previous['timestamp']}:")
+    for scenario, summary in results.items():
+        before = previous['results'].get(scenario)
+        if not before:
+            continue
+        change = summary['wall_p50'] - before['wall_p50']
+        print(f"  {scenario}: wall p50 {before['wall_p50']:.2f}s -> {summary['wall_p50']:.2f}s ({change:+.2f}s), "
+              f"API calls {before['calls']} -> {summary['calls']}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the provisioning flow against a local AWS stand-in.")
+    parser.add_argument('--scenario', choices=SCENARIOS + ('all',), default='all')
+    parser.add_argument('--iterations', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=150, help="injected latency per API call in ms")
+    parser.add_argument('--jitter', type=float, default=50, help="random +/- jitter on the latency in ms")
+    parser.add_argument('--throttle-rate', type=float, default=0.0,
+                        help="fraction of API calls answered with a throttling error")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--results', default=os.path.join(HERE, 'benchmark-results.jsonl'),
+                        help="JSON lines file the results are appended to")
+    parser.add_argument('--compare', action='store_true',
+                        help="compare with the last stored run that used the same parameters")
+    parser.add_argument('--verbose', action='store_true', help="show the deployment output")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as image_dir:
+        # moto only reads its AMI catalogue on import, so point it at a small
+        # one holding the Ubuntu image fetch_ami_id looks for.
+        image_path = os.path.join(image_dir, 'amis.json')
+        with open(image_path, 'w') as image_file:
+            json.dump([BASE_IMAGE], image_file)
+        os.environ['MOTO_AMIS_PATH'] = image_path
+        os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+        os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+        try:
+            from moto import mock_aws
+        except ImportError:
+            sys.exit('The benchmark needs moto: pip install "moto[ec2,elbv2,autoscaling]"')
+
+        deployment = load_deployment()
+        rng = random.Random(args.seed)
+        scenarios = SCENARIOS if args.scenario == 'all' else (args.scenario,)
+        results = {}
+        for scenario in scenarios:
+            runs = [run_scenario(deployment, mock_aws, scenario, args, rng) for _ in range(args.iterations)]
+            results[scenario] = summarize(runs)
+
+    print_report(results)
+
+    params = {'latency': args.latency, 'jitter': args.jitter, 'throttle_rate': args.throttle_rate,
+              'iterations': args.iterations}
+    if args.compare:
+        previous = previous_result(args.results, params)
+        if previous:
+            print_comparison(previous, results)
+        else:
+            print("No earlier run with the same parameters to compare with.")
+
+    record = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'revision': git_revision(),
+        'params': params,
+        'results': results,
+    }
+    with open(args.results, 'a') as results_file:
+        results_file.write(json.dumps(record) + '\n')
+    print(f"Results appended to {args.results}")
+
+
+if __name__ == "__main__":
+    main()
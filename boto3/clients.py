@@ -0,0 +1,140 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import boto3
+from botocore.config import Config
+
+from ratelimit import rate_limiter
+
+DEFAULT_PROFILE = 'profile1'
+DEFAULT_REGION = 'ap-northeast-3'
+
+client_options = {
+    'max_pool_connections': 32,
+    'connect_timeout': 5,
+    'read_timeout': 60,
+    'tcp_keepalive': True,
+    # Throttles are paced and retried by ratelimit.rate_limiter, which shares
+    # its buckets across clients; botocore only retries the other errors.
+    'retries': {'mode': 'standard', 'max_attempts': 10},
+}
+
+_lock = threading.Lock()
+_sessions = {}
+_clients = {}
+_threaded = {}
+_pool = None
+
+
+def configure(**options):
+    """Override the botocore Config used for new clients, e.g.
+    ``configure(max_pool_connections=64)``. Cached clients are dropped."""
+    with _lock:
+        client_options.update(options)
+        _clients.clear()
+        _threaded.clear()
+
+
+def get_session(profile=DEFAULT_PROFILE, region=DEFAULT_REGION):
+    with _lock:
+        return _get_session(profile, region)
+
+
+def _get_session(profile, region):
+    key = (profile, region)
+    if key not in _sessions:
+        _sessions[key] = boto3.Session(profile_name=profile, region_name=region)
+    return _sessions[key]
+
+
+def get_client(service, profile=DEFAULT_PROFILE, region=DEFAULT_REGION):
+    # Sessions are not thread-safe but the clients they create are, so
+    # clients are built under the lock and then shared by every worker.
+    key = (profile, region, service)
+    with _lock:
+        if key not in _clients:
+            session = _get_session(profile, region)
+            _clients[key] = session.client(service, config=Config(**client_options))
+            rate_limiter.attach(_clients[key])
+        return _clients[key]
+
+
+def _thread_pool():
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=client_options['max_pool_connections'],
+                                       thread_name_prefix='boto3')
+        return _pool
+
+
+async def run_blocking(func, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(_thread_pool(), partial(func, *args, **kwargs))
+
+
+class ThreadedClient:
+    """Awaitable view of a boto3 client: every call, page and waiter runs on a
+    shared thread pool, so the coroutine helpers drive boto3 clients the same
+    way they drive aiobotocore ones."""
+
+    def __init__(self, client):
+        self.client = client
+        self.meta = client.meta
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+
+        async def call(*args, **kwargs):
+            return await run_blocking(method, *args, **kwargs)
+
+        return call
+
+    def can_paginate(self, operation):
+        return self.client.can_paginate(operation)
+
+    def get_paginator(self, operation):
+        return _ThreadedPaginator(self.client.get_paginator(operation))
+
+    def get_waiter(self, waiter_name):
+        return _ThreadedWaiter(self.client.get_waiter(waiter_name))
+
+
+class _ThreadedPaginator:
+
+    def __init__(self, paginator):
+        self._paginator = paginator
+
+    async def paginate(self, **kwargs):
+        pages = iter(self._paginator.paginate(**kwargs))
+        while True:
+            page = await run_blocking(next, pages, None)
+            if page is None:
+                return
+            yield page
+
+
+class _ThreadedWaiter:
+
+    def __init__(self, waiter):
+        self._waiter = waiter
+
+    async def wait(self, **kwargs):
+        await run_blocking(self._waiter.wait, **kwargs)
+
+
+def get_threaded_client(service, profile=DEFAULT_PROFILE, region=DEFAULT_REGION):
+    client = get_client(service, profile, region)
+    key = (profile, region, service)
+    with _lock:
+        if key not in _threaded or _threaded[key].client is not client:
+            _threaded[key] = ThreadedClient(client)
+        return _threaded[key]
+
+
+def clear_cache():
+    with _lock:
+        _clients.clear()
+        _threaded.clear()
+        _sessions.clear()
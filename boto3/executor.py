@@ -0,0 +1,105 @@
+import asyncio
+import time
+
+from tracing import tracer
+
+
+class StepFailed(Exception):
+    pass
+
+
+class Step:
+    """A unit of provisioning work.
+
+    ``func`` is a coroutine function called with one keyword argument per
+    name in ``requires``; it must return a dict holding every name in
+    ``provides``.
+    """
+
+    def __init__(self, name, func, requires=(), provides=()):
+        self.name = name
+        self.func = func
+        self.requires = tuple(requires)
+        self.provides = tuple(provides)
+
+    def __repr__(self):
+        return f"Step({self.name!r})"
+
+
+def validate_steps(steps, available):
+    providers = {}
+    for step in steps:
+        for key in step.provides:
+            if key in available or key in providers:
+                raise ValueError(f"'{key}' is provided more than once (step {step.name})")
+            providers[key] = step.name
+
+    for step in steps:
+        missing = [key for key in step.requires if key not in available and key not in providers]
+        if missing:
+            raise ValueError(f"Step {step.name} requires {', '.join(missing)} but nothing provides it")
+
+    known = set(available)
+    remaining = list(steps)
+    while remaining:
+        ready = [step for step in remaining if known.issuperset(step.requires)]
+        if not ready:
+            names = ', '.join(step.name for step in remaining)
+            raise ValueError(f"Dependency cycle between steps: {names}")
+        for step in ready:
+            known.update(step.provides)
+            remaining.remove(step)
+
+
+async def _run_step(step, inputs):
+    start = time.monotonic()
+    with tracer.span(step.name):
+        outputs = await step.func(**inputs) or {}
+    missing = [key for key in step.provides if key not in outputs]
+    if missing:
+        raise StepFailed(f"Step {step.name} did not produce {', '.join(missing)}")
+    print(f"Step {step.name} finished in {time.monotonic() - start:.1f}s")
+    return {key: outputs[key] for key in step.provides}
+
+
+async def run_steps(steps, context=None):
+    """Run ``steps`` as tasks on the running loop, starting each one as soon
+    as everything it requires is in the context. Returns the final context.
+
+    After the first failure no new steps are started; steps already running
+    are allowed to finish and ``StepFailed`` is raised once they have.
+    """
+    context = dict(context or {})
+    validate_steps(steps, context)
+
+    pending = list(steps)
+    running = {}
+    failures = []
+
+    while pending or running:
+        if not failures:
+            ready = [step for step in pending if all(key in context for key in step.requires)]
+            for step in ready:
+                pending.remove(step)
+                inputs = {key: context[key] for key in step.requires}
+                running[asyncio.ensure_future(_run_step(step, inputs))] = step
+
+        if not running:
+            break
+
+        done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            step = running.pop(task)
+            try:
+                context.update(task.result())
+            except Exception as e:
+                print(f"Step {step.name} failed: {e}")
+                failures.append(step.name)
+
+    if failures:
+        skipped = ', '.join(step.name for step in pending)
+        message = f"Failed steps: {', '.join(failures)}"
+        if skipped:
+            message += f"; skipped: {skipped}"
+        raise StepFailed(message)
+    return context
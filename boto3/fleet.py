@@ -0,0 +1,16 @@
+FLEET_INSTANCE_STATES = ('pending', 'running')
+
+
+def fleet_placements(subnet_ids, instances, size):
+    """How many instances to launch in each subnet so the fleet reaches
+    ``size``, always topping up the emptiest subnet first."""
+    counts = {subnet_id: 0 for subnet_id in subnet_ids}
+    for instance in instances:
+        if instance.get('SubnetId') in counts:
+            counts[instance['SubnetId']] += 1
+    placements = {}
+    for _ in range(size - len(instances)):
+        subnet_id = min(counts, key=lambda subnet: (counts[subnet], subnet_ids.index(subnet)))
+        counts[subnet_id] += 1
+        placements[subnet_id] = placements.get(subnet_id, 0) + 1
+    return placements
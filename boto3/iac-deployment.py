@@ -1,33 +1,64 @@
-import boto3
-from botocore.exceptions import ClientError
+import argparse
+import asyncio
+import json
+import os
+import re
 import time
+from contextlib import contextmanager
 
-def get_default_vpc_id(ec2_client):
+from botocore.exceptions import ClientError, WaiterError
+from functools import partial
+
+from async_engine import ENGINES, open_clients
+from bakes import bake_hash, bake_name, bake_tag_specifications, collect_bakes, find_bake
+from batching import authorize_ports, call_savings, register_targets, revoke_ports, tag_list, tag_specifications
+from clients import DEFAULT_PROFILE, DEFAULT_REGION
+from executor import Step, StepFailed, run_steps
+from fleet import FLEET_INSTANCE_STATES, fleet_placements
+from inventory import load_inventory
+from journal import Journal
+from loadtest import DEFAULT_ROUTES, LoadTestError, load_test, resolve
+from network import Network, Subnet, discover_availability_zones, subnet_cidrs
+from lookups import (CANONICAL_OWNER_ID, collect, first, first_async, iter_auto_scaling_groups, iter_images, iter_instances,
+                     iter_key_pairs, iter_launch_templates, iter_listeners, iter_load_balancers, iter_scaling_policies,
+                     iter_security_groups, iter_subnets, iter_target_groups, iter_vpcs, name_filter)
+from readiness import ReadinessError, get_public_ips, wait_for_instances_ready
+from ratelimit import rate_limiter
+from reconcile import desired_state, diff
+from rollout import RolloutError, configure_draining, default_version, pin_version, roll_out
+from scaling import launch_template_data, policy_matches, scaling_policies
+from teardown import destroy, stack_tags
+from tracing import tracer
+from userdata import VALUES_PATH, build_user_data, load_services
+
+async def get_default_vpc_id(ec2_client, inventory=None, vpc_name='default_vpc', security_group_name='testec2-sg'):
     try:
-        response = ec2_client.describe_vpcs(Filters=[{'Name': 'tag:Name', 'Values': ["default_vpc"]}])
-        if response['Vpcs']:
-            vpc_id = response['Vpcs'][0]['VpcId']
-            print(f"VPC default_vpc already exists. VPC id : {vpc_id}")
+        if inventory is not None:
+            vpc = inventory.get('vpcs', vpc_name)
+        else:
+            vpc = await first_async(iter_vpcs(ec2_client, [name_filter(vpc_name)]))
+        if vpc:
+            vpc_id = vpc['VpcId']
+            print(f"VPC {vpc_name} already exists. VPC id : {vpc_id}")
 
-        
-            response = ec2_client.describe_security_groups(
-                Filters=[
+            if inventory is not None:
+                sg = first(inventory.select('security_groups', VpcId=vpc_id, GroupName=security_group_name))
+            else:
+                sg = await first_async(iter_security_groups(ec2_client, [
                     {'Name': 'vpc-id', 'Values': [vpc_id]},
-                    {'Name': 'group-name', 'Values': ['testec2-sg']}
-                ]
-            )
-            if response['SecurityGroups']:
-                for sg in response['SecurityGroups']:
-                    sg_id = sg['GroupId']
-                    print(f"Security group testec2-sg already exists. VPC id : {sg_id}")
-                    current_ports = set()
-                    
-                    for rule in sg['IpPermissions']:
-                        from_port = rule.get('FromPort')
-                        to_port = rule.get('ToPort')
-                        
-                        if from_port == to_port:
-                            current_ports.add(from_port)
+                    {'Name': 'group-name', 'Values': [security_group_name]}
+                ]))
+            if sg:
+                sg_id = sg['GroupId']
+                print(f"Security group {security_group_name} already exists. VPC id : {sg_id}")
+                current_ports = set()
+
+                for rule in sg['IpPermissions']:
+                    from_port = rule.get('FromPort')
+                    to_port = rule.get('ToPort')
+
+                    if from_port == to_port:
+                        current_ports.add(from_port)
                 return vpc_id, sg_id, current_ports
             else:
                 return vpc_id, None, set() 
@@ -37,76 +68,62 @@ def get_default_vpc_id(ec2_client):
         print(f"An error occurred: {e}")
         return None, None, set()
 
-def update_default_security_group(ec2_client, required_ports, current_ports, sg_id):
+async def update_default_security_group(ec2_client, required_ports, current_ports, sg_id):
     try:
         ports_to_add = required_ports - current_ports
         ports_to_remove = current_ports - required_ports
         
         if ports_to_add:
             print(f"Adding ports {ports_to_add} to security group {sg_id}")
-            for port in ports_to_add:
-                ec2_client.authorize_security_group_ingress(
-                    GroupId=sg_id,
-                    IpPermissions=[{
-                        'IpProtocol': 'tcp',
-                        'FromPort': port,
-                        'ToPort': port,
-                        'IpRanges': [{'CidrIp': '0.0.0.0/0'}]
-                    }]
-                )
-        
+            await authorize_ports(ec2_client, sg_id, ports_to_add)
+
         if ports_to_remove:
             print(f"Removing ports {ports_to_remove} from security group {sg_id}")
-            for port in ports_to_remove:
-                if port is not None: 
-                    ec2_client.revoke_security_group_ingress(
-                        GroupId=sg_id,
-                        IpPermissions=[{
-                            'IpProtocol': 'tcp',
-                            'FromPort': port,
-                            'ToPort': port,
-                            'IpRanges': [{'CidrIp': '0.0.0.0/0'}]
-                        }]
-                    )
+            await revoke_ports(ec2_client, sg_id, ports_to_remove)
     except ClientError as e:
         print(f"An error occurred: {e}")
 
-def fetch_ami_id():
+async def fetch_ami_id(ec2_client):
     try:
-        session = boto3.Session(profile_name='profile1', region_name="eu-north-1")
-        ec2_client = session.client('ec2')
-
-        response = ec2_client.describe_images(Owners=['099720109477'])
-
-        for image in response['Images']:
-            if image['Name'] == "ubuntu/images/hvm-ssd/ubuntu-jammy-22.04-amd64-server-20240411":
-                image_id = image['ImageId']
-                print(f"Image name: {image['Name']} and Image ID is: {image_id}")
-                return image_id
+        image = await first_async(iter_images(
+            ec2_client,
+            [{'Name': 'name', 'Values': ["ubuntu/images/hvm-ssd/ubuntu-jammy-22.04-amd64-server-20240411"]}],
+            owners=[CANONICAL_OWNER_ID]
+        ))
+        if image:
+            image_id = image['ImageId']
+            print(f"Image name: {image['Name']} and Image ID is: {image_id}")
+            return image_id
     except ClientError as e:
         print(f"An error occurred: {e}")
     return None
 
-def create_key_pair(ec2_client, key_pair_name):
+async def create_key_pair(ec2_client, key_pair_name, inventory=None, tags=None):
     try:
-        existing_key_pairs = ec2_client.describe_key_pairs()
-        for existing_key_pair in existing_key_pairs['KeyPairs']:
-            if existing_key_pair['KeyName'] == key_pair_name:
-                print(f"Key pair {key_pair_name} already exists.")
-                return
-        key_pair_response = ec2_client.create_key_pair(KeyName=key_pair_name)
+        if inventory is not None:
+            existing_key_pair = inventory.get('key_pairs', key_pair_name)
+        else:
+            existing_key_pair = await first_async(iter_key_pairs(ec2_client, [{'Name': 'key-name', 'Values': [key_pair_name]}]))
+        if existing_key_pair:
+            print(f"Key pair {key_pair_name} already exists.")
+            return
+        key_pair_response = await ec2_client.create_key_pair(
+            KeyName=key_pair_name,
+            TagSpecifications=tag_specifications('key-pair', key_pair_name, tags)
+        )
         with open(f'{key_pair_name}.pem', 'w') as key_file:
             key_file.write(key_pair_response['KeyMaterial'])
         print(f"Key pair {key_pair_name} created and saved.")
     except ClientError as e:
         print(f"An error occurred: {e}")
 
-def create_security_group(ec2_client, vpc_id):
+async def create_security_group(ec2_client, vpc_id, tags=None, group_name='testec2-sg'):
     try:
-        response = ec2_client.create_security_group(
-            GroupName='testec2-sg',
+        response = await ec2_client.create_security_group(
+            GroupName=group_name,
             Description='Security group for test EC2 instance',
-            VpcId=vpc_id
+            VpcId=vpc_id,
+            TagSpecifications=tag_specifications('security-group', group_name, tags)
         )
         security_group_id = response['GroupId']
         print(f"Security Group Created {security_group_id} in VPC {vpc_id}")
@@ -116,64 +133,82 @@ def create_security_group(ec2_client, vpc_id):
         print(f"An error occurred: {e}")
         return None
 
-def create_vpc(ec2_client):
+async def create_vpc(ec2_client, azs=None, tags=None, cidr_block='10.0.0.0/16', vpc_name='default_vpc'):
+    """Create the VPC with one public subnet per AZ, every AZ of the region
+    unless ``azs`` is given. Returns a ``Network`` or None."""
     try:
-        response = ec2_client.create_vpc(CidrBlock='10.0.0.0/16')
+        azs = sorted(azs) if azs else await discover_availability_zones(ec2_client)
+        cidrs = subnet_cidrs(cidr_block, len(azs))
+        response = await ec2_client.create_vpc(
+            CidrBlock=cidr_block,
+            TagSpecifications=tag_specifications('vpc', vpc_name, tags)
+        )
         vpc_id = response['Vpc']['VpcId']
-        ec2_client.create_tags(Resources=[vpc_id], Tags=[{'Key': 'Name', 'Value': 'default_vpc'}])
-        ec2_client.modify_vpc_attribute(VpcId=vpc_id, EnableDnsSupport={'Value': True})
-        ec2_client.modify_vpc_attribute(VpcId=vpc_id, EnableDnsHostnames={'Value': True})
-
-        subnet_ids = []
-        azs = ['eu-north-1a', 'eu-north-1b'] 
-        for i, az in enumerate(azs):
-            subnet_response = ec2_client.create_subnet(
+
+        async def create_subnet(az, cidr):
+            subnet_response = await ec2_client.create_subnet(
                 VpcId=vpc_id,
-                CidrBlock=f'10.0.{i}.0/24',
-                AvailabilityZone=az
+                CidrBlock=cidr,
+                AvailabilityZone=az,
+                TagSpecifications=tag_specifications('subnet', f'default_subnet_{az}', tags)
             )
             subnet_id = subnet_response['Subnet']['SubnetId']
-            subnet_ids.append(subnet_id)
-            ec2_client.create_tags(Resources=[subnet_id], Tags=[{'Key': 'Name', 'Value': f'default_subnet_{az}'}])
-
-            ec2_client.modify_subnet_attribute(
+            await ec2_client.modify_subnet_attribute(
                 SubnetId=subnet_id,
                 MapPublicIpOnLaunch={'Value': True}
             )
+            return Subnet(subnet_id, az, cidr)
 
-        igw_response = ec2_client.create_internet_gateway()
-        igw_id = igw_response['InternetGateway']['InternetGatewayId']
-        ec2_client.attach_internet_gateway(InternetGatewayId=igw_id, VpcId=vpc_id)
+        async def create_internet_gateway():
+            igw_response = await ec2_client.create_internet_gateway(
+                TagSpecifications=tag_specifications('internet-gateway', 'default_igw', tags)
+            )
+            igw_id = igw_response['InternetGateway']['InternetGatewayId']
+            await ec2_client.attach_internet_gateway(InternetGatewayId=igw_id, VpcId=vpc_id)
+            return igw_id
 
-        route_table_response = ec2_client.create_route_table(VpcId=vpc_id)
-        if 'RouteTable' not in route_table_response:
-            print("Failed to create route table.")
-            return None, []
-        
-        route_table_id = route_table_response['RouteTable']['RouteTableId']
-        ec2_client.create_route(
-            RouteTableId=route_table_id,
-            DestinationCidrBlock='0.0.0.0/0',
-            GatewayId=igw_id
-        )
+        async def create_route_table():
+            route_table_response = await ec2_client.create_route_table(
+                VpcId=vpc_id,
+                TagSpecifications=tag_specifications('route-table', 'default_route_table', tags)
+            )
+            return route_table_response['RouteTable']['RouteTableId']
 
-        for subnet_id in subnet_ids:
-            ec2_client.associate_route_table(RouteTableId=route_table_id, SubnetId=subnet_id)
+        async def create_gateway_and_routes():
+            igw_id, route_table_id = await asyncio.gather(create_internet_gateway(), create_route_table())
+            await ec2_client.create_route(
+                RouteTableId=route_table_id,
+                DestinationCidrBlock='0.0.0.0/0',
+                GatewayId=igw_id
+            )
+            return igw_id, route_table_id
+
+        # Everything below only needs the VPC, so it is all sent at once.
+        _, _, (igw_id, route_table_id), *subnets = await asyncio.gather(
+            ec2_client.modify_vpc_attribute(VpcId=vpc_id, EnableDnsSupport={'Value': True}),
+            ec2_client.modify_vpc_attribute(VpcId=vpc_id, EnableDnsHostnames={'Value': True}),
+            create_gateway_and_routes(),
+            *(create_subnet(az, cidr) for az, cidr in zip(azs, cidrs))
+        )
+        await asyncio.gather(*(ec2_client.associate_route_table(RouteTableId=route_table_id, SubnetId=subnet.subnet_id)
+                               for subnet in subnets))
 
-        return vpc_id, subnet_ids
+        call_savings.record('create_tags', 0, 1 + len(subnets))
+        print(f"VPC {vpc_id} created with subnets in {', '.join(azs)}")
+        return Network(vpc_id, cidr_block, subnets, igw_id, route_table_id)
     except ClientError as e:
         print(f"An error occurred: {e}")
-        return None, []
+        return None
 
 
-def get_subnet_id(ec2_client, vpc_id):
+async def get_subnet_id(ec2_client, vpc_id, inventory=None):
     try:
-        response = ec2_client.describe_subnets(Filters=[{'Name': 'vpc-id', 'Values': [vpc_id]}])
-        subnets = []
-        if response['Subnets']:
-            for subnet in response['Subnets']:
-                subnets.append(subnet['SubnetId'])
-            return subnets 
+        if inventory is not None:
+            subnets = [subnet['SubnetId'] for subnet in inventory.select('subnets', VpcId=vpc_id)]
+        else:
+            subnets = [subnet['SubnetId'] async for subnet in iter_subnets(ec2_client, [{'Name': 'vpc-id', 'Values': [vpc_id]}])]
+        if subnets:
+            return subnets
         else:
             print("No subnets found in the specified VPC.")
             return None
@@ -181,44 +216,43 @@ def get_subnet_id(ec2_client, vpc_id):
         print(f"An error occurred: {e}")
         return None
 
-def check_ec2_instance(ec2_client, servername):
+async def check_ec2_instance(ec2_client, servername, inventory=None):
 
     try:
-        response = ec2_client.describe_instances(
-            Filters=[
-                {'Name': 'tag:Name', 'Values': [servername]},
-                {'Name': 'instance-state-name', 'Values': ['running']}
-            ]
-        )
-
-        if 'Reservations' in response:
-            for reservation in response['Reservations']:
-                for instance in reservation['Instances']:
-                    print(f"{servername} Instance Already Present, Instance ID: {instance['InstanceId']}")
-                    return instance['InstanceId']
+        if inventory is not None:
+            instance = first(instance for instance in inventory.find('instances', servername)
+                             if instance['State']['Name'] == 'running')
         else:
-            return None
+            instance = await first_async(iter_instances(ec2_client, [
+                name_filter(servername),
+                {'Name': 'instance-state-name', 'Values': ['running']}
+            ]))
+        if instance:
+            print(f"{servername} Instance Already Present, Instance ID: {instance['InstanceId']}")
+            return instance['InstanceId']
+        return None
     except ClientError as e:
         print(f"An error occurred: {e}")
 
-def check_mern_ami(ec2_client, ami_name):
+async def check_mern_ami(ec2_client, ami_name, digest, inventory=None):
     try:
-        existing_amis = ec2_client.describe_images(Filters=[{'Name': 'name', 'Values': [ami_name]}])
-        if existing_amis['Images']:
-            print(f"AMI with name '{ami_name}' already exists. Skipping AMI creation. AMI id : {existing_amis['Images'][0]['ImageId']}")
-            return existing_amis['Images'][0]['ImageId']
+        existing_ami = await find_bake(ec2_client, ami_name, digest, inventory)
+        if existing_ami:
+            print(f"AMI '{existing_ami.get('Name')}' matches bake {digest}. Skipping AMI creation. AMI id : {existing_ami['ImageId']}")
+            return existing_ami
         else:
             return None
     except ClientError as e:
         print(f"An error occurred: {e}")
         return None
-def create_ami(ec2_client, instance_id, ami_name):
+async def create_ami(ec2_client, instance_id, ami_name, tag_specs=()):
     try:
-        response = ec2_client.create_image(
+        response = await ec2_client.create_image(
             InstanceId=instance_id,
             Name=ami_name,
             Description='AMI created from running MERN instance',
-            NoReboot=True
+            NoReboot=True,
+            TagSpecifications=list(tag_specs)
         )
         ami_id = response['ImageId']
         print(f"AMI {ami_id} created from instance {instance_id}")
@@ -226,25 +260,15 @@ def create_ami(ec2_client, instance_id, ami_name):
     except ClientError as e:
         print(f"An error occurred: {e}")
         return None
-def create_ec2_instance(ec2_client,key_pair_name,sg_id,ami_image_id,user_data_script,subnet_id,servername):
+async def create_ec2_instance(ec2_client,key_pair_name,sg_id,ami_image_id,user_data_script,subnet_id,servername,instance_type='t3.micro',tags=None):
     try:
-        instance_response = ec2_client.run_instances(
+        instance_response = await ec2_client.run_instances(
             ImageId=ami_image_id,
-            InstanceType='t3.micro',
+            InstanceType=instance_type,
             KeyName=key_pair_name,
             MinCount=1,
             MaxCount=1,
-            TagSpecifications=[
-                {
-                    'ResourceType': 'instance',
-                    'Tags': [
-                        {
-                            'Key': 'Name',
-                            'Value': servername
-                        }
-                    ]
-                }
-            ],
+            TagSpecifications=tag_specifications('instance', servername, tags),
             SubnetId=subnet_id,
             SecurityGroupIds=[sg_id],
             UserData=user_data_script
@@ -261,30 +285,73 @@ def create_ec2_instance(ec2_client,key_pair_name,sg_id,ami_image_id,user_data_sc
     except ClientError as e:
         print(f"An error occurred: {e}")
 
-def check_existing_target_group(elbv2_client, target_group_name):
+async def check_fleet_instances(ec2_client, fleet_name, inventory=None):
     try:
-        response = elbv2_client.describe_target_groups()
-        if response['TargetGroups']:
-            for target_group in response['TargetGroups']:
-                if target_group['TargetGroupName'] == target_group_name:
-                    target_group_arn = target_group['TargetGroupArn']
-                    return target_group_arn
+        if inventory is not None:
+            instances = [instance for instance in inventory.find('instances', fleet_name)
+                         if instance['State']['Name'] in FLEET_INSTANCE_STATES]
         else:
-            return None
+            instances = await collect(iter_instances(ec2_client, [
+                name_filter(fleet_name),
+                {'Name': 'instance-state-name', 'Values': list(FLEET_INSTANCE_STATES)}
+            ]))
+        if instances:
+            print(f"{len(instances)} {fleet_name} instances already present: {', '.join(i['InstanceId'] for i in instances)}")
+        return instances
+    except ClientError as e:
+        print(f"An error occurred: {e}")
+        return None
+
+async def create_fleet_instances(ec2_client, key_pair_name, sg_id, ami_image_id, user_data_script, placements, fleet_name,
+                                 instance_type, tags=None):
+    # RunInstances takes a single subnet, so the fleet is one request per
+    # subnet, all sent at once.
+    async def launch(subnet_id, count):
+        response = await ec2_client.run_instances(
+            ImageId=ami_image_id,
+            InstanceType=instance_type,
+            KeyName=key_pair_name,
+            MinCount=count,
+            MaxCount=count,
+            TagSpecifications=tag_specifications('instance', fleet_name, tags),
+            SubnetId=subnet_id,
+            SecurityGroupIds=[sg_id],
+            UserData=user_data_script
+        )
+        return [instance['InstanceId'] for instance in response.get('Instances', [])]
+
+    try:
+        launched = await asyncio.gather(*(launch(subnet_id, count) for subnet_id, count in placements.items()))
+        call_savings.record('run_instances', len(placements), sum(placements.values()))
+        return [instance_id for instance_ids in launched for instance_id in instance_ids]
     except ClientError as e:
         print(f"An error occurred: {e}")
         return None
 
-def create_target_group_with_instances(elbv2_client, target_group_name, vpc_id, protocol, port, instances):
+async def check_existing_target_group(elbv2_client, target_group_name, inventory=None):
     try:
-        existing_target_group_arn = check_existing_target_group(elbv2_client, target_group_name)
+        if inventory is not None:
+            target_group = inventory.get('target_groups', target_group_name)
+        else:
+            target_group = await first_async(iter_target_groups(elbv2_client, [target_group_name]))
+        if target_group:
+            return target_group['TargetGroupArn']
+        return None
+    except ClientError as e:
+        print(f"An error occurred: {e}")
+        return None
+
+async def create_target_group_with_instances(elbv2_client, target_group_name, vpc_id, protocol, port, instances, inventory=None,
+                                             tags=None):
+    try:
+        existing_target_group_arn = await check_existing_target_group(elbv2_client, target_group_name, inventory)
         if existing_target_group_arn:
             print(f"Target group {target_group_name} already exists with ARN: {existing_target_group_arn}")
             return existing_target_group_arn
         else:
             print("Target group with desired name is not present, Creating.....")
         
-        response = elbv2_client.create_target_group(
+        response = await elbv2_client.create_target_group(
             Name=target_group_name,
             Protocol=protocol,
             Port=port,
@@ -296,22 +363,15 @@ def create_target_group_with_instances(elbv2_client, target_group_name, vpc_id,
             HealthCheckIntervalSeconds=30,
             HealthCheckTimeoutSeconds=10,
             HealthyThresholdCount=3,
-            UnhealthyThresholdCount=3
+            UnhealthyThresholdCount=3,
+            Tags=tag_list(dict({'Name': target_group_name}, **(tags or {})))
         )
         target_group_arn = response['TargetGroups'][0]['TargetGroupArn']
         print(f"Target group {target_group_name} created with ARN: {target_group_arn}")
         
         if instances:
-            for instance in instances:
-                elbv2_client.register_targets(
-                    TargetGroupArn=target_group_arn,
-                    Targets=[
-                        {
-                            'Id': instance
-                        }
-                    ]
-                )
-                print(f"Instance {instance} registered with target group {target_group_name}")
+            registered = await register_targets(elbv2_client, target_group_arn, instances)
+            print(f"Instances {', '.join(registered)} registered with target group {target_group_name}")
         
         return target_group_arn
     except ClientError as e:
@@ -319,27 +379,30 @@ def create_target_group_with_instances(elbv2_client, target_group_name, vpc_id,
         return None
 
 
-def check_load_balancer_exists(elb_client, lb_name):
+async def check_load_balancer_exists(elb_client, lb_name, inventory=None):
     try: 
-        response = elb_client.describe_load_balancers()
-        # print(response)
-        if response['LoadBalancers']:
-            return response['LoadBalancers'][0]['LoadBalancerArn']
+        if inventory is not None:
+            load_balancer = inventory.get('load_balancers', lb_name)
+        else:
+            load_balancer = await first_async(iter_load_balancers(elb_client, [lb_name]))
+        if load_balancer:
+            return load_balancer['LoadBalancerArn']
         else:
             return None
     except ClientError as e:
         print(f"An error occurred: {e}")
         return None 
     
-def create_load_balancer(elb_client, lb_name, subnet_id, sg_id):
+async def create_load_balancer(elb_client, lb_name, subnet_id, sg_id, tags=None):
     try: 
-        response = elb_client.create_load_balancer(
+        response = await elb_client.create_load_balancer(
             Name=lb_name,
             Subnets=subnet_id, 
             SecurityGroups=[sg_id],  
             Scheme='internet-facing',
             Type='application',
-            IpAddressType='ipv4'
+            IpAddressType='ipv4',
+            Tags=tag_list(dict({'Name': lb_name}, **(tags or {})))
         )
         if response['LoadBalancers']:
             return response['LoadBalancers'][0]['LoadBalancerArn']
@@ -350,19 +413,22 @@ def create_load_balancer(elb_client, lb_name, subnet_id, sg_id):
         return None
 
 
-def check_listener_exists(elb_client, load_balancer_arn):
+async def check_listener_exists(elb_client, load_balancer_arn, inventory=None):
     try:
-        response = elb_client.describe_listeners(LoadBalancerArn=load_balancer_arn)
-        if response['Listeners']:
-            return response['Listeners'][0]['ListenerArn']
+        if inventory is not None:
+            listener = inventory.get('listeners', load_balancer_arn)
+        else:
+            listener = await first_async(iter_listeners(elb_client, load_balancer_arn))
+        if listener:
+            return listener['ListenerArn']
         else:
             return None
     except ClientError as e:
         print(f"An error occurred: {e}")
         return None
-def create_listener(elb_client, load_balancer_arn, target_group_arn):
+async def create_listener(elb_client, load_balancer_arn, target_group_arn):
     try:
-        response = elb_client.create_listener(
+        response = await elb_client.create_listener(
             LoadBalancerArn=load_balancer_arn,
             Protocol='HTTP',
             Port=80,
@@ -381,62 +447,68 @@ def create_listener(elb_client, load_balancer_arn, target_group_arn):
         print(f"An error occurred: {e}")
         return None
     
-def check_launch_configuration_exists(asg_client, launch_configuration_name):
+async def check_launch_template_exists(ec2_client, launch_template_name, inventory=None):
     try:
-        response = asg_client.describe_launch_configurations(
-            LaunchConfigurationNames=[launch_configuration_name]
-        )
-        if response['LaunchConfigurations']:
-            print(f"Launch Configuration {launch_configuration_name} already exists.")
-            return response['LaunchConfigurations'][0]['LaunchConfigurationName']
+        if inventory is not None:
+            launch_template = inventory.get('launch_templates', launch_template_name)
+        else:
+            launch_template = await first_async(iter_launch_templates(ec2_client, [launch_template_name]))
+        if launch_template:
+            print(f"Launch Template {launch_template_name} already exists.")
+            return launch_template['LaunchTemplateId']
         else:
             return None
     except ClientError as e:
-        print(f"An error occurred while checking Launch Configuration: {e}")
+        print(f"An error occurred while checking Launch Template: {e}")
         return None
 
-def create_launch_configuration(asg_client, launch_configuration_name, ami_id, instance_type, key_name, security_group_id):
+async def create_launch_template(ec2_client, launch_template_name, ami_id, instance_type, key_name, security_group_id,
+                                 user_data_script, tags=None):
     try:
-        response = asg_client.create_launch_configuration(
-            LaunchConfigurationName=launch_configuration_name,
-            ImageId=ami_id,
-            InstanceType=instance_type,
-            KeyName=key_name,
-            SecurityGroups=[security_group_id],
+        response = await ec2_client.create_launch_template(
+            LaunchTemplateName=launch_template_name,
+            LaunchTemplateData=launch_template_data(ami_id, instance_type, key_name, security_group_id,
+                                                    user_data_script, launch_template_name),
+            TagSpecifications=tag_specifications('launch-template', launch_template_name, tags)
         )
-        print(f"Launch Configuration {launch_configuration_name} created successfully.")
-        return launch_configuration_name
+        launch_template_id = response['LaunchTemplate']['LaunchTemplateId']
+        print(f"Launch Template {launch_template_name} created successfully: {launch_template_id}")
+        return launch_template_id
     except ClientError as e:
-        print(f"An error occurred while creating Launch Configuration: {e}")
+        print(f"An error occurred while creating Launch Template: {e}")
         return None
 
-def check_auto_scaling_group_exists(asg_client, asg_name):
+async def check_auto_scaling_group_exists(asg_client, asg_name, inventory=None):
     try:
-        response = asg_client.describe_auto_scaling_groups(AutoScalingGroupNames=[asg_name])
-        if response['AutoScalingGroups']:
+        if inventory is not None:
+            auto_scaling_group = inventory.get('auto_scaling_groups', asg_name)
+        else:
+            auto_scaling_group = await first_async(iter_auto_scaling_groups(asg_client, [asg_name]))
+        if auto_scaling_group:
             print(f"Auto Scaling Group {asg_name} already exists.")
-            return response['AutoScalingGroups'][0]['AutoScalingGroupName']
+            return auto_scaling_group
         else:
             return None
     except ClientError as e:
         print(f"An error occurred while checking ASG: {e}")
         return None
 
-def create_auto_scaling_group(asg_client, asg_name, launch_configuration_name, vpc_id, subnet_ids):
+async def create_auto_scaling_group(asg_client, asg_name, launch_template_id, launch_template_version, subnet_ids,
+                                    target_group_arn, capacity, tags=None):
     try:
-        response = asg_client.create_auto_scaling_group(
+        await asg_client.create_auto_scaling_group(
             AutoScalingGroupName=asg_name,
-            LaunchConfigurationName=launch_configuration_name,
-            MinSize=1,
-            MaxSize=2,
-            DesiredCapacity=1,
+            LaunchTemplate={'LaunchTemplateId': launch_template_id, 'Version': launch_template_version},
+            MinSize=capacity['min'],
+            MaxSize=capacity['max'],
+            DesiredCapacity=capacity['desired'],
             VPCZoneIdentifier=','.join(subnet_ids),
+            TargetGroupARNs=[target_group_arn],
+            HealthCheckType='ELB',
+            HealthCheckGracePeriod=capacity.get('health_check_grace_period', 300),
             Tags=[
-                {
-                    'Key': 'Name',
-                    'Value': asg_name,
-                    'PropagateAtLaunch': True
-                }
+                dict(tag, PropagateAtLaunch=True)
+                for tag in tag_list(dict({'Name': asg_name}, **(tags or {})))
             ]
         )
         print(f"Auto Scaling Group {asg_name} created successfully.")
@@ -445,97 +517,654 @@ def create_auto_scaling_group(asg_client, asg_name, launch_configuration_name, v
         print(f"An error occurred while creating ASG: {e}")
         return None
 
-def main():
-    try:
-        required_ports = {22, 3000, 3001, 80, 4411}
-        key_pair_name = 'sonal-instance'
-        ami_name = 'AMISonalMern'
-        lb_name = 'mern-load-balancing'
-        asg_name = 'SonalASG'
-        launch_configuration_name = 'MERNAppLaunchConfiguration'
-        instance_type = 't3.micro'
-        session = boto3.Session(profile_name='profile1', region_name="ap-northeast-3")
-        ec2_client = session.client('ec2')
-        elbv2_client = session.client('elbv2')
-        asg_client = session.client('autoscaling')
-
-        vpc_id, sg_id, current_ports = get_default_vpc_id(ec2_client)
-
-        if not vpc_id:
-            print("Default VPC not found. Creating...")
-            vpc_id = create_vpc(ec2_client)
-            sg_id = create_security_group(ec2_client, vpc_id)
-
-        if not sg_id:
-            print("Security group not found. Creating...")
-            sg_id = create_security_group(ec2_client, vpc_id)
-
-        update_default_security_group(ec2_client, required_ports, current_ports, sg_id)
-
-        subnet_id = get_subnet_id(ec2_client, vpc_id)
-
-        primary_instance_id = check_ec2_instance(ec2_client, servername='primaryserver')
-        if primary_instance_id is None:
-            print("Primary server instance not found, creating one...")
-            create_key_pair(ec2_client, key_pair_name)
-            ami_image_id = fetch_ami_id()
-            if ami_image_id is None:
-                print("AMI ID not found")
-                return
-            primary_instance_id = create_ec2_instance(ec2_client, key_pair_name, sg_id, ami_image_id, user_data_script, subnet_id[0], servername='primaryserver')
-            if primary_instance_id is not None:
-                print(f"Primary server created: {primary_instance_id}")
-                print("Waiting for the instance to be up and userdata to execute...")
-                time.sleep(420)
-                ami_id = create_ami(ec2_client, primary_instance_id, ami_name)
-                waiter = ec2_client.get_waiter('image_available')
-                print("Waiting for AMI to become available...")
-                waiter.wait(ImageIds=[ami_id])
-                print(f"AMI {ami_id} is now available.")
+async def delete_launch_configuration(asg_client, launch_configuration_name, inventory=None):
+    if inventory is not None and inventory.get('launch_configurations', launch_configuration_name) is None:
+        return
+    try:
+        await asg_client.delete_launch_configuration(LaunchConfigurationName=launch_configuration_name)
+        print(f"Launch configuration {launch_configuration_name} deleted.")
+    except ClientError as e:
+        # Another group may still launch from it.
+        print(f"Kept launch configuration {launch_configuration_name}: {e}")
+
+async def update_auto_scaling_group(asg_client, auto_scaling_group, launch_template_id, launch_template_version,
+                                    target_group_arn, capacity, inventory=None):
+    asg_name = auto_scaling_group['AutoScalingGroupName']
+    try:
+        current = auto_scaling_group.get('LaunchTemplate') or {}
+        if (current.get('LaunchTemplateId'), current.get('Version')) != (launch_template_id, launch_template_version):
+            await pin_version(asg_client, asg_name, launch_template_id, launch_template_version)
+            print(f"Auto Scaling Group {asg_name} now launches version {launch_template_version} "
+                  f"of {launch_template_id}.")
+            # Groups made before the move to launch templates launched from a
+            # launch configuration, which nothing uses any more.
+            if not current and auto_scaling_group.get('LaunchConfigurationName'):
+                await delete_launch_configuration(asg_client, auto_scaling_group['LaunchConfigurationName'], inventory)
+        if (auto_scaling_group.get('MinSize'), auto_scaling_group.get('MaxSize')) != (capacity['min'], capacity['max']):
+            # DesiredCapacity is left to the scaling policies.
+            await asg_client.update_auto_scaling_group(AutoScalingGroupName=asg_name, MinSize=capacity['min'],
+                                                       MaxSize=capacity['max'])
+            print(f"Auto Scaling Group {asg_name} resized to min {capacity['min']}, max {capacity['max']}.")
+        if target_group_arn not in auto_scaling_group.get('TargetGroupARNs', []):
+            await asg_client.attach_load_balancer_target_groups(AutoScalingGroupName=asg_name,
+                                                                TargetGroupARNs=[target_group_arn])
+            print(f"Target group {target_group_arn} attached to Auto Scaling Group {asg_name}.")
+        return asg_name
+    except ClientError as e:
+        print(f"An error occurred while updating ASG: {e}")
+        return None
+
+async def put_scaling_policies(asg_client, asg_name, policies, inventory=None):
+    try:
+        if inventory is not None:
+            existing = {policy['PolicyName']: policy for policy in inventory.select('scaling_policies', AutoScalingGroupName=asg_name)}
         else:
-            ami_id = check_mern_ami(ec2_client, ami_name)
+            existing = {policy['PolicyName']: policy async for policy in iter_scaling_policies(asg_client, asg_name)}
+        for policy_name, configuration in policies.items():
+            if policy_matches(existing.get(policy_name), configuration):
+                continue
+            await asg_client.put_scaling_policy(
+                AutoScalingGroupName=asg_name,
+                PolicyName=policy_name,
+                PolicyType='TargetTrackingScaling',
+                EstimatedInstanceWarmup=300,
+                TargetTrackingConfiguration=configuration
+            )
+            print(f"Target tracking policy {policy_name} set on {asg_name}.")
+        return list(policies)
+    except ClientError as e:
+        print(f"An error occurred while setting scaling policies: {e}")
+        return None
+
+async def put_warm_pool(asg_client, auto_scaling_group, warm_pool):
+    asg_name = auto_scaling_group['AutoScalingGroupName']
+    current = auto_scaling_group.get('WarmPoolConfiguration') or {}
+    try:
+        if not warm_pool:
+            if current:
+                await asg_client.delete_warm_pool(AutoScalingGroupName=asg_name, ForceDelete=True)
+                print(f"Warm pool of {asg_name} deleted.")
+            return None
+        if current.get('MinSize') != warm_pool['min_size'] or current.get('PoolState') != warm_pool['pool_state']:
+            await asg_client.put_warm_pool(AutoScalingGroupName=asg_name, MinSize=warm_pool['min_size'],
+                                           PoolState=warm_pool['pool_state'])
+            print(f"Warm pool of {warm_pool['min_size']} {warm_pool['pool_state'].lower()} instances set on {asg_name}.")
+        return warm_pool
+    except ClientError as e:
+        print(f"An error occurred while setting the warm pool: {e}")
+        return None
+
+async def register_instances(elbv2_client, target_group_arn, instances):
+    try:
+        response = await elbv2_client.describe_target_health(TargetGroupArn=target_group_arn)
+        already_registered = {target['Target']['Id'] for target in response['TargetHealthDescriptions']}
+        missing = [instance for instance in instances if instance not in already_registered]
+        if missing:
+            registered = await register_targets(elbv2_client, target_group_arn, missing)
+            print(f"Instances {', '.join(registered)} registered with target group {target_group_arn}")
+        return list(instances)
+    except ClientError as e:
+        print(f"An error occurred: {e}")
+        return None
+
+async def step_network(ec2_client, inventory, availability_zones, vpc_cidr, vpc_name, security_group_name, stack):
+    vpc_id, sg_id, current_ports = await get_default_vpc_id(ec2_client, inventory, vpc_name, security_group_name)
+
+    if not vpc_id:
+        print("Default VPC not found. Creating...")
+        with tracer.span('create_vpc', category='resource'):
+            network = await create_vpc(ec2_client, availability_zones, stack_tags(stack), vpc_cidr, vpc_name)
+        if network is None:
+            raise StepFailed("Failed to create VPC.")
+        vpc_id = network.vpc_id
+
+    if not sg_id:
+        print("Security group not found. Creating...")
+        sg_id = await create_security_group(ec2_client, vpc_id, stack_tags(stack), security_group_name)
+        if sg_id is None:
+            raise StepFailed("Failed to create security group.")
+
+    return {'vpc_id': vpc_id, 'sg_id': sg_id, 'current_ports': current_ports}
+
+async def step_security_group_rules(ec2_client, required_ports, current_ports, sg_id):
+    await update_default_security_group(ec2_client, required_ports, current_ports, sg_id)
+    return {'sg_rules': required_ports}
+
+async def step_subnets(ec2_client, inventory, vpc_id):
+    subnet_ids = await get_subnet_id(ec2_client, vpc_id, inventory)
+    if not subnet_ids:
+        raise StepFailed(f"No subnets found in VPC {vpc_id}.")
+    return {'subnet_ids': subnet_ids}
+
+async def step_key_pair(ec2_client, inventory, key_pair_name, stack):
+    await create_key_pair(ec2_client, key_pair_name, inventory, stack_tags(stack))
+    return {'key_pair': key_pair_name}
+
+async def step_base_ami(ec2_client):
+    base_ami_id = await fetch_ami_id(ec2_client)
+    if base_ami_id is None:
+        raise StepFailed("AMI ID not found")
+    return {'base_ami_id': base_ami_id}
+
+async def wait_until_ready(ec2_client, instance_ids, readiness):
+    print("Waiting for the instances to be up and userdata to execute...")
+    try:
+        with tracer.span('wait:instance_ready', category='wait', instance_ids=instance_ids):
+            await wait_for_instances_ready(ec2_client, instance_ids, **readiness)
+    except ReadinessError as e:
+        raise StepFailed(str(e))
+
+async def wait_for_image(ec2_client, ami_id):
+    waiter = ec2_client.get_waiter('image_available')
+    print(f"Waiting for AMI {ami_id} to become available...")
+    with tracer.span('wait:image_available', category='wait', ami_id=ami_id):
+        await waiter.wait(ImageIds=[ami_id])
+    print(f"AMI {ami_id} is now available.")
+
+async def step_bake_ami(ec2_client, inventory, key_pair, sg_id, sg_rules, subnet_ids, base_ami_id, ami_name, instance_type,
+                        user_data, readiness, bake_retention, launch_template_name, stack):
+    digest = bake_hash(user_data, base_ami_id, instance_type)
+    image = await check_mern_ami(ec2_client, ami_name, digest, inventory)
+    if image is not None:
+        # A run stopped while the image was still being created leaves it
+        # pending; nothing can launch from it until it is available.
+        if image.get('State') == 'pending':
+            await wait_for_image(ec2_client, image['ImageId'])
+        return {'ami_id': image['ImageId']}
+
+    print(f"No AMI matches bake {digest}, baking one...")
+    with tracer.span('bake_ami', category='resource', ami_name=ami_name, bake_hash=digest):
+        builder_id = await create_ec2_instance(ec2_client, key_pair, sg_id, base_ami_id, user_data, subnet_ids[0],
+                                               servername='mern-ami-builder', instance_type=instance_type,
+                                               tags=stack_tags(stack))
+        if builder_id is None:
+            raise StepFailed("Failed to create AMI builder instance.")
+        try:
+            await wait_until_ready(ec2_client, [builder_id], readiness)
+            ami_id = await create_ami(ec2_client, builder_id, bake_name(ami_name, digest),
+                                      bake_tag_specifications(ami_name, digest, base_ami_id, stack_tags(stack)))
             if ami_id is None:
-                ami_id = create_ami(ec2_client, primary_instance_id, ami_name)
-                waiter = ec2_client.get_waiter('image_available')
-                print("Waiting for AMI to become available...")
-                waiter.wait(ImageIds=[ami_id])
-                print(f"AMI {ami_id} is now available.")
-
-        secondary_instance_id = check_ec2_instance(ec2_client, servername='secondaryserver')
-        if secondary_instance_id is None:
-            print("Secondary server instance not found, creating one...")
-            secondary_instance_id = create_ec2_instance(ec2_client, key_pair_name, sg_id, ami_id, user_data_script, subnet_id[0], servername='secondaryserver')
-            if secondary_instance_id is not None:
-                print(f"Secondary server created: {secondary_instance_id}")
-                print("Waiting for the instance to be up and userdata to execute...")
-                time.sleep(420)
-
-        target_group_arn = create_target_group_with_instances(elbv2_client, 'MyTargetGroup', vpc_id, 'HTTP', 80, [primary_instance_id, secondary_instance_id])
-        if target_group_arn is None:
-            print("Failed to create target group.")
-            return
+                raise StepFailed("Failed to create AMI.")
+            await wait_for_image(ec2_client, ami_id)
+        finally:
+            await ec2_client.terminate_instances(InstanceIds=[builder_id])
 
-        load_balancing_arn = check_load_balancer_exists(elbv2_client, lb_name)
-        if load_balancing_arn is None:
-            load_balancing_arn = create_load_balancer(elbv2_client, lb_name, subnet_id, sg_id)
-        if load_balancing_arn is not None:
-            listener_arn = check_listener_exists(elbv2_client, load_balancing_arn)
-            if listener_arn is None:
-                listener_arn = create_listener(elbv2_client, load_balancing_arn, target_group_arn)
-        else:
-            print("Failed to create load balancer.")
-            return
+    await collect_bakes(ec2_client, ami_name, protect={ami_id}, launch_template_name=launch_template_name,
+                        **bake_retention)
+    return {'ami_id': ami_id}
 
-        launch_configuration_exists = check_launch_configuration_exists(asg_client, launch_configuration_name)
-        if launch_configuration_exists is None:
-            create_launch_configuration(asg_client, launch_configuration_name, ami_id, instance_type, key_pair_name, sg_id)
+async def step_fleet(ec2_client, inventory, key_pair, sg_id, sg_rules, subnet_ids, ami_id, user_data, readiness, fleet_name,
+                     fleet_size, instance_type, stack):
+    instances = await check_fleet_instances(ec2_client, fleet_name, inventory)
+    if instances is None:
+        raise StepFailed(f"Failed to look up {fleet_name} instances.")
+    instance_ids = [instance['InstanceId'] for instance in instances]
 
-        asg_exists = check_auto_scaling_group_exists(asg_client, asg_name)
-        if asg_exists is None:
-            create_auto_scaling_group(asg_client, asg_name, launch_configuration_name, vpc_id, subnet_id)
+    placements = fleet_placements(subnet_ids, instances, fleet_size)
+    if placements:
+        print(f"Launching {sum(placements.values())} {fleet_name} instances across {len(placements)} subnets...")
+        launched = await create_fleet_instances(ec2_client, key_pair, sg_id, ami_id, user_data, placements, fleet_name,
+                                                instance_type, stack_tags(stack))
+        if not launched:
+            raise StepFailed(f"Failed to launch {fleet_name} instances.")
+        print(f"{fleet_name} instances created: {', '.join(launched)}")
+        await wait_until_ready(ec2_client, launched, readiness)
+        instance_ids += launched
+    return {'fleet_instance_ids': instance_ids}
 
+async def step_target_group(elbv2_client, inventory, target_group_name, vpc_id, rollout, stack):
+    target_group_arn = await create_target_group_with_instances(elbv2_client, target_group_name, vpc_id, 'HTTP', 80, [],
+                                                                inventory, stack_tags(stack))
+    if target_group_arn is None:
+        raise StepFailed("Failed to create target group.")
+    try:
+        await configure_draining(elbv2_client, target_group_arn, rollout['deregistration_delay'], rollout['slow_start'])
     except ClientError as e:
-        print(f"An error occurred: {e}")
+        raise StepFailed(f"Failed to configure target group draining: {e}")
+    return {'target_group_arn': target_group_arn}
+
+async def step_register_targets(elbv2_client, target_group_arn, fleet_instance_ids):
+    registered = await register_instances(elbv2_client, target_group_arn, fleet_instance_ids)
+    if registered is None:
+        raise StepFailed(f"Failed to register targets with {target_group_arn}.")
+    return {'registered_targets': registered}
+
+async def step_load_balancer(elbv2_client, inventory, lb_name, subnet_ids, sg_id, stack):
+    load_balancing_arn = await check_load_balancer_exists(elbv2_client, lb_name, inventory)
+    if load_balancing_arn is None:
+        load_balancing_arn = await create_load_balancer(elbv2_client, lb_name, subnet_ids, sg_id, stack_tags(stack))
+    if load_balancing_arn is None:
+        raise StepFailed("Failed to create load balancer.")
+    return {'load_balancer_arn': load_balancing_arn}
+
+async def step_listener(elbv2_client, inventory, load_balancer_arn, target_group_arn):
+    listener_arn = await check_listener_exists(elbv2_client, load_balancer_arn, inventory)
+    if listener_arn is None:
+        listener_arn = await create_listener(elbv2_client, load_balancer_arn, target_group_arn)
+    if listener_arn is None:
+        raise StepFailed("Failed to create listener.")
+    return {'listener_arn': listener_arn}
+
+async def step_launch_template(ec2_client, inventory, launch_template_name, ami_id, instance_type, key_pair, sg_id,
+                               user_data, stack):
+    launch_template_id = await check_launch_template_exists(ec2_client, launch_template_name, inventory)
+    if launch_template_id is None:
+        launch_template_id = await create_launch_template(ec2_client, launch_template_name, ami_id, instance_type,
+                                                          key_pair, sg_id, user_data, stack_tags(stack))
+        if launch_template_id is None:
+            raise StepFailed("Failed to create launch template.")
+    return {'launch_template_id': launch_template_id}
+
+async def step_auto_scaling_group(ec2_client, asg_client, inventory, asg_name, launch_template_id, subnet_ids,
+                                  target_group_arn, asg_capacity, stack):
+    # The group is pinned to the default version by number; see rollout.py.
+    try:
+        version = await default_version(ec2_client, launch_template_id)
+    except ClientError as e:
+        raise StepFailed(f"Failed to look up launch template {launch_template_id}: {e}")
+    auto_scaling_group = await check_auto_scaling_group_exists(asg_client, asg_name, inventory)
+    if auto_scaling_group is None:
+        if await create_auto_scaling_group(asg_client, asg_name, launch_template_id, version, subnet_ids,
+                                           target_group_arn, asg_capacity, stack_tags(stack)) is None:
+            raise StepFailed("Failed to create auto scaling group.")
+    elif await update_auto_scaling_group(asg_client, auto_scaling_group, launch_template_id, version,
+                                         target_group_arn, asg_capacity, inventory) is None:
+        raise StepFailed("Failed to update auto scaling group.")
+    return {'auto_scaling_group': asg_name}
+
+async def step_scaling_policies(asg_client, inventory, auto_scaling_group, load_balancer_arn, target_group_arn, listener_arn,
+                                scaling_targets):
+    # ALBRequestCountPerTarget is only accepted once the listener routes the
+    # load balancer to the target group, hence listener_arn.
+    policies = scaling_policies(auto_scaling_group, load_balancer_arn, target_group_arn, scaling_targets)
+    if await put_scaling_policies(asg_client, auto_scaling_group, policies, inventory) is None:
+        raise StepFailed(f"Failed to set scaling policies on {auto_scaling_group}.")
+    return {'scaling_policies': list(policies)}
+
+async def step_warm_pool(asg_client, inventory, auto_scaling_group, warm_pool):
+    group = await check_auto_scaling_group_exists(asg_client, auto_scaling_group, inventory) or {}
+    if await put_warm_pool(asg_client, dict(group, AutoScalingGroupName=auto_scaling_group), warm_pool) is None and warm_pool:
+        raise StepFailed(f"Failed to set the warm pool of {auto_scaling_group}.")
+    return {'warm_pool_configured': bool(warm_pool)}
+
+async def step_rollout(ec2_client, elbv2_client, asg_client, auto_scaling_group, launch_template_id, ami_id, user_data,
+                       target_group_arn, warm_pool_configured, scaling_policies, rollout):
+    try:
+        version = await roll_out(ec2_client, elbv2_client, asg_client, auto_scaling_group, launch_template_id, ami_id,
+                                 user_data, target_group_arn, rollout)
+    except (ClientError, RolloutError) as e:
+        raise StepFailed(str(e))
+    return {'launch_template_version': version}
+
+async def wait_for_traffic(elbv2_client, load_balancer_arn, target_group_arn, instance_ids, deadline, delay=15):
+    """Wait until the load balancer is active, the instances are healthy
+    targets and its DNS name resolves. Returns the DNS name."""
+    waiter_config = {'Delay': delay, 'MaxAttempts': max(1, int((deadline - time.monotonic()) // delay))}
+    with tracer.span('wait:load_balancer_available', category='wait'):
+        await elbv2_client.get_waiter('load_balancer_available').wait(LoadBalancerArns=[load_balancer_arn],
+                                                                      WaiterConfig=waiter_config)
+    with tracer.span('wait:target_in_service', category='wait'):
+        await elbv2_client.get_waiter('target_in_service').wait(
+            TargetGroupArn=target_group_arn, Targets=[{'Id': instance_id} for instance_id in instance_ids],
+            WaiterConfig=waiter_config
+        )
+    response = await elbv2_client.describe_load_balancers(LoadBalancerArns=[load_balancer_arn])
+    return await resolve(response['LoadBalancers'][0]['DNSName'], deadline)
+
+async def step_load_test(ec2_client, elbv2_client, load_balancer_arn, listener_arn, target_group_arn, registered_targets,
+                         fleet_instance_ids, load_test_settings):
+    if not load_test_settings:
+        return {'load_test_results': None}
+    deadline = time.monotonic() + load_test_settings['ready_timeout']
+    try:
+        dns_name = await wait_for_traffic(elbv2_client, load_balancer_arn, target_group_arn, fleet_instance_ids, deadline)
+        hosts = {
+            'load_balancer': [dns_name],
+            'instances': list((await get_public_ips(ec2_client, fleet_instance_ids)).values()),
+        }
+        print(f"Load testing {dns_name} and {len(hosts['instances'])} instances...")
+        # The load test drives its own worker threads.
+        results = await asyncio.to_thread(load_test, hosts, load_test_settings)
+    except (ClientError, WaiterError, ReadinessError, LoadTestError) as e:
+        raise StepFailed(str(e))
+    return {'load_test_results': results}
+
+def build_steps(ec2_client, elbv2_client, asg_client, inventory, redeploy=False):
+    steps = [
+        Step('network', partial(step_network, ec2_client, inventory),
+             requires=('availability_zones', 'vpc_cidr', 'vpc_name', 'security_group_name', 'stack'), provides=('vpc_id', 'sg_id', 'current_ports')),
+        Step('security_group_rules', partial(step_security_group_rules, ec2_client),
+             requires=('required_ports', 'current_ports', 'sg_id'), provides=('sg_rules',)),
+        Step('subnets', partial(step_subnets, ec2_client, inventory),
+             requires=('vpc_id',), provides=('subnet_ids',)),
+        Step('key_pair', partial(step_key_pair, ec2_client, inventory),
+             requires=('key_pair_name', 'stack'), provides=('key_pair',)),
+        Step('base_ami', partial(step_base_ami, ec2_client),
+             provides=('base_ami_id',)),
+        Step('bake_ami', partial(step_bake_ami, ec2_client, inventory),
+             requires=('key_pair', 'sg_id', 'sg_rules', 'subnet_ids', 'base_ami_id', 'ami_name', 'instance_type',
+                       'user_data', 'readiness', 'bake_retention', 'launch_template_name', 'stack'),
+             provides=('ami_id',)),
+        Step('fleet', partial(step_fleet, ec2_client, inventory),
+             requires=('key_pair', 'sg_id', 'sg_rules', 'subnet_ids', 'ami_id', 'user_data', 'readiness', 'fleet_name',
+                       'fleet_size', 'instance_type', 'stack'),
+             provides=('fleet_instance_ids',)),
+        Step('target_group', partial(step_target_group, elbv2_client, inventory),
+             requires=('target_group_name', 'vpc_id', 'rollout', 'stack'), provides=('target_group_arn',)),
+        Step('register_targets', partial(step_register_targets, elbv2_client),
+             requires=('target_group_arn', 'fleet_instance_ids'),
+             provides=('registered_targets',)),
+        Step('load_balancer', partial(step_load_balancer, elbv2_client, inventory),
+             requires=('lb_name', 'subnet_ids', 'sg_id', 'stack'), provides=('load_balancer_arn',)),
+        Step('listener', partial(step_listener, elbv2_client, inventory),
+             requires=('load_balancer_arn', 'target_group_arn'), provides=('listener_arn',)),
+        Step('launch_template', partial(step_launch_template, ec2_client, inventory),
+             requires=('launch_template_name', 'ami_id', 'instance_type', 'key_pair', 'sg_id', 'user_data', 'stack'),
+             provides=('launch_template_id',)),
+        Step('auto_scaling_group', partial(step_auto_scaling_group, ec2_client, asg_client, inventory),
+             requires=('asg_name', 'launch_template_id', 'subnet_ids', 'target_group_arn', 'asg_capacity', 'stack'),
+             provides=('auto_scaling_group',)),
+        Step('scaling_policies', partial(step_scaling_policies, asg_client, inventory),
+             requires=('auto_scaling_group', 'load_balancer_arn', 'target_group_arn', 'listener_arn', 'scaling_targets'),
+             provides=('scaling_policies',)),
+        Step('warm_pool', partial(step_warm_pool, asg_client, inventory),
+             requires=('auto_scaling_group', 'warm_pool'),
+             provides=('warm_pool_configured',)),
+    ]
+    if redeploy:
+        steps.append(Step('rollout', partial(step_rollout, ec2_client, elbv2_client, asg_client),
+                          requires=('auto_scaling_group', 'launch_template_id', 'ami_id', 'user_data',
+                                    'target_group_arn', 'warm_pool_configured', 'scaling_policies', 'rollout'),
+                          provides=('launch_template_version',)))
+    # After a rollout the load test has to hit the new instances.
+    steps.append(Step('load_test', partial(step_load_test, ec2_client, elbv2_client),
+                      requires=('load_balancer_arn', 'listener_arn', 'target_group_arn', 'registered_targets',
+                                'fleet_instance_ids', 'load_test_settings')
+                               + (('launch_template_version',) if redeploy else ()),
+                      provides=('load_test_results',)))
+    return steps
+
+# Load balancer and target group names are at most 32 letters, digits and
+# hyphens, and the longest suffix below is three characters.
+STACK_NAME = re.compile(r'^[A-Za-z0-9](?:[A-Za-z0-9-]{0,27}[A-Za-z0-9])?$')
+
+def resource_names(name=None):
+    """Names of the stack's resources. Unnamed targets keep the names the
+    stack has always used; a named target prefixes its own, so that several
+    stacks can live in one region."""
+    if name is None:
+        return {
+            'vpc_name': 'default_vpc',
+            'security_group_name': 'testec2-sg',
+            'key_pair_name': 'sonal-instance',
+            'ami_name': 'AMISonalMern',
+            'lb_name': 'mern-load-balancing',
+            'asg_name': 'SonalASG',
+            'target_group_name': 'MyTargetGroup',
+            'launch_template_name': 'MERNAppLaunchTemplate',
+            'fleet_name': 'mernserver',
+        }
+    if not STACK_NAME.match(name):
+        raise ValueError(f"Target name {name!r} must be 1-29 letters, digits and hyphens, "
+                         "and must not start or end with a hyphen")
+    return {
+        'vpc_name': f'{name}-vpc',
+        'security_group_name': f'{name}-sg',
+        'key_pair_name': f'{name}-key',
+        'ami_name': f'{name}-ami',
+        'lb_name': f'{name}-lb',
+        'asg_name': f'{name}-asg',
+        'target_group_name': f'{name}-tg',
+        'launch_template_name': f'{name}-lt',
+        'fleet_name': f'{name}-server',
+    }
+
+def default_config(region=DEFAULT_REGION, name=None):
+    return {
+        'name': name or region,
+        # Every resource is tagged with the stack so that destroy can find it.
+        'stack': name or region,
+        'required_ports': {22, 3000, 3001, 3002, 80, 4411},
+        **resource_names(name),
+        'asg_capacity': {
+            'min': 1,
+            'max': 4,
+            'desired': 1,
+            'health_check_grace_period': 300,
+        },
+        'scaling_targets': {
+            'requests_per_target': 1000,
+            'cpu_percent': 50,
+        },
+        # e.g. {'min_size': 1, 'pool_state': 'Stopped'} keeps pre-initialized
+        # instances ready for scale-out.
+        'warm_pool': None,
+        'rollout': {
+            'min_healthy_percentage': 90,
+            'instance_warmup': 300,
+            'deregistration_delay': 60,
+            'slow_start': 30,
+            'timeout': 3600,
+            'unhealthy_grace': 120,
+        },
+        'instance_type': 't3.micro',
+        'fleet_size': 2,
+        # Services and images come from the Helm chart's values; service_env
+        # adds variables to a service's environment on top of its PORT.
+        'service_values': VALUES_PATH,
+        'service_env': {'profileService': {'MONGO_URL': os.environ.get('MONGO_URL')}},
+        'user_data_cache': '.user-data',
+        'profile': DEFAULT_PROFILE,
+        'region': region,
+        # None spreads the VPC across every AZ of the region.
+        'availability_zones': None,
+        'vpc_cidr': '10.0.0.0/16',
+        'inventory_cache': f'.inventory-{name or region}.json',
+        'inventory_ttl': 600,
+        'journal': f'.journal-{name or region}.json',
+        'readiness': {
+            'timeout': 600,
+            'health_ports': (3001, 3002),
+            'check_marker': True,
+        },
+        'bake_retention': {
+            'keep': 3,
+            'max_age_days': 30,
+        },
+        'destroy_timeout': 900,
+        # Post-deploy load test; the run fails if a route breaches its SLO.
+        # None skips it. The default routes only read; add loadtest.WRITE_ROUTES
+        # for a stack whose MONGO_URL points at a test database.
+        'load_test_settings': {
+            'concurrency': 10,
+            'duration': 30,
+            'timeout': 5,
+            'ready_timeout': 600,
+            'routes': DEFAULT_ROUTES,
+            'slo': {'p95_ms': 500, 'p99_ms': 1000, 'max_error_rate': 0.01},
+        },
+    }
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Provision the MERN stack on EC2.")
+    parser.add_argument('--plan', action='store_true',
+                        help="print the changes a run would make and exit without touching anything")
+    parser.add_argument('--refresh', action='store_true',
+                        help="ignore the cached inventory and describe the account again")
+    parser.add_argument('--trace', metavar='PATH',
+                        help="write a Chrome trace of steps and AWS calls to PATH")
+    parser.add_argument('--redeploy', action='store_true',
+                        help="roll the auto scaling group onto the current AMI with an instance refresh")
+    parser.add_argument('--destroy', action='store_true',
+                        help="delete everything tagged with the stack, dependents first; with --plan only list it")
+    parser.add_argument('--engine', choices=ENGINES, default='threads',
+                        help="make AWS calls with boto3 on a thread pool, or with aiobotocore on the event loop")
+    parser.add_argument('--region', action='append', dest='regions', metavar='REGION',
+                        help="deploy to REGION; repeat to deploy to several regions in parallel")
+    parser.add_argument('--targets', metavar='FILE',
+                        help="JSON list of per-target settings (name, region, availability_zones, "
+                             "lb_name, asg_name, ...) to deploy in parallel; resource names default "
+                             "from the target's name")
+    parser.add_argument('--max-concurrency', type=positive_int, default=4,
+                        help="how many targets are deployed at the same time")
+    return parser.parse_args(argv)
+
+def target_config(overrides):
+    """default_config() for the target's region and name, with the
+    target's own settings on top."""
+    config = default_config(overrides.get('region', DEFAULT_REGION), overrides.get('name'))
+    config.update(overrides)
+    return config
+
+def load_targets(args):
+    targets = []
+    if args.targets:
+        with open(args.targets) as targets_file:
+            targets.extend(json.load(targets_file))
+    targets.extend({'region': region} for region in args.regions or ())
+    return [target_config(target) for target in targets]
+
+def main(argv=None):
+    args = parse_args(argv)
+    options = {'plan_only': args.plan, 'refresh': args.refresh, 'trace_path': args.trace, 'redeploy': args.redeploy,
+               'teardown': args.destroy, 'engine': args.engine}
+    targets = load_targets(args)
+    if targets:
+        results = run_many(targets, args.max_concurrency, **options)
+        raise SystemExit(0 if all(result['ok'] for result in results.values()) else 1)
+    raise SystemExit(0 if run(default_config(), **options) else 1)
+
+@contextmanager
+def traced(clients, trace_path=None):
+    """Trace the calls made through ``clients`` for the duration of the
+    block, then print the summaries and write the trace."""
+    instrumented = {id(client): client for client in clients}
+    for client in instrumented.values():
+        tracer.instrument(client)
+    try:
+        yield
+    finally:
+        for client in instrumented.values():
+            tracer.uninstrument(client)
+        tracer.summary()
+        rate_limiter.report()
+        if trace_path:
+            tracer.write(trace_path)
+
+def run(config, plan_only=False, refresh=False, trace_path=None, redeploy=False, teardown=False, engine='threads'):
+    async def run_target():
+        async with open_clients([config], engine) as clients:
+            target_clients = clients[config['name']]
+            with traced(target_clients.values(), trace_path):
+                if teardown:
+                    return await destroy(config, target_clients, plan_only)
+                return await provision(config, target_clients, plan_only, refresh, redeploy)
+
+    return asyncio.run(run_target())
+
+def run_many(configs, max_concurrency=4, plan_only=False, refresh=False, trace_path=None, redeploy=False, teardown=False,
+             engine='threads'):
+    """Provision every config in ``configs`` concurrently, at most
+    ``max_concurrency`` at a time. Returns ``{name: {'ok': ..., 'seconds': ...}}``."""
+    names = [config['name'] for config in configs]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Target names must be unique: {', '.join(names)}")
+
+    async def provision_target(clients, semaphore, config):
+        async with semaphore:
+            start = time.monotonic()
+            with tracer.span(f"target:{config['name']}", category='target', region=config['region']):
+                try:
+                    if teardown:
+                        ok = await destroy(config, clients, plan_only)
+                    else:
+                        ok = await provision(config, clients, plan_only, refresh, redeploy)
+                except Exception as e:
+                    print(f"Deployment of {config['name']} failed: {e}")
+                    ok = False
+            return {'ok': ok, 'seconds': time.monotonic() - start}
+
+    async def run_targets():
+        semaphore = asyncio.Semaphore(max_concurrency)
+        async with open_clients(configs, engine) as clients:
+            with traced([client for target in clients.values() for client in target.values()], trace_path):
+                results = await asyncio.gather(*(provision_target(clients[config['name']], semaphore, config)
+                                                  for config in configs))
+        return dict(zip(names, results))
+
+    results = asyncio.run(run_targets())
+
+    action = 'Destroyed' if teardown else 'Deployed'
+    print(f"{action} {sum(1 for result in results.values() if result['ok'])}/{len(results)} targets:")
+    for config in configs:
+        result = results[config['name']]
+        status = 'ok' if result['ok'] else 'FAILED'
+        print(f"  {config['name']:<24}{config['region']:<18}{status:<8}{result['seconds']:>8.1f}s")
+    return results
+
+def with_user_data(config):
+    """``config`` with the instance bootstrap rendered from its services,
+    unless it brings its own ``user_data``."""
+    if 'user_data' in config:
+        return config
+    with tracer.span('render_user_data', category='phase'):
+        services = load_services(config['service_values'], config['service_env'])
+        return dict(config, user_data=build_user_data(services, config['user_data_cache']))
+
+async def provision(config, clients, plan_only=False, refresh=False, redeploy=False):
+    try:
+        config = with_user_data(config)
+    except ValueError as e:
+        print(f"Deployment failed: {e}")
+        return False
+
+    with tracer.span('load_inventory', category='phase'):
+        inventory = await load_inventory(clients, config['inventory_cache'], 0 if refresh else config['inventory_ttl'])
+
+    plan = diff(desired_state(config), inventory)
+    plan.print()
+    journal = Journal.load(config['journal'])
+    steps = build_steps(clients['ec2'], clients['elbv2'], clients['autoscaling'], inventory, redeploy)
+    resume = journal.unfinished(steps)
+    if resume and not plan_only:
+        print(f"Resuming the last run, which did not finish: {', '.join(sorted(resume))}")
+    if plan_only or not (plan.changes or redeploy or resume):
+        if not plan_only:
+            print("Nothing to do, the stack is up to date.")
+        inventory.persist(config['inventory_cache'])
+        return True
+
+    for client in clients.values():
+        inventory.watch(client)
+
+    try:
+        if not redeploy:
+            # The load test gates every run that changes something.
+            gate = {'load_test'} if config['load_test_settings'] else set()
+            steps = plan.prune_steps(steps, include=resume | gate)
+        # Steps carrying out a planned change always run; the others may be
+        # restored from the journal.
+        changed = {action.step for action in plan.changes}
+        journal.begin(steps)
+        await run_steps([journal.wrap(step, None if step.name in changed else inventory) for step in steps],
+                        context=config)
+        journal.finish()
+        return True
+    except StepFailed as e:
+        print(f"Deployment failed: {e}")
+        inventory.stale = True
+        return False
+    finally:
+        for client in clients.values():
+            inventory.unwatch(client)
+        inventory.persist(config['inventory_cache'])
+        call_savings.report()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,203 @@
+import asyncio
+import json
+import os
+import threading
+import time
+
+from lookups import (collect, iter_auto_scaling_groups, iter_images, iter_instances, iter_key_pairs,
+                     iter_launch_configurations, iter_launch_templates, iter_listeners, iter_load_balancers,
+                     iter_scaling_policies, iter_security_groups, iter_subnets, iter_target_groups, iter_vpcs)
+
+LIVE_INSTANCE_STATES = ['pending', 'running', 'stopping', 'stopped']
+
+# kind -> (client, loader, fields the index is keyed on besides the Name tag)
+KINDS = {
+    'vpcs': ('ec2', iter_vpcs, ('VpcId',)),
+    'subnets': ('ec2', iter_subnets, ('SubnetId',)),
+    'security_groups': ('ec2', iter_security_groups, ('GroupId', 'GroupName')),
+    'instances': ('ec2', lambda client: iter_instances(client, [{'Name': 'instance-state-name', 'Values': LIVE_INSTANCE_STATES}]),
+                  ('InstanceId',)),
+    'images': ('ec2', lambda client: iter_images(client, owners=['self']), ('ImageId', 'Name')),
+    'key_pairs': ('ec2', iter_key_pairs, ('KeyPairId', 'KeyName')),
+    'target_groups': ('elbv2', iter_target_groups, ('TargetGroupArn', 'TargetGroupName')),
+    'load_balancers': ('elbv2', iter_load_balancers, ('LoadBalancerArn', 'LoadBalancerName')),
+    'listeners': ('elbv2', None, ('ListenerArn', 'LoadBalancerArn')),
+    'launch_configurations': ('autoscaling', iter_launch_configurations,
+                              ('LaunchConfigurationARN', 'LaunchConfigurationName')),
+    'auto_scaling_groups': ('autoscaling', iter_auto_scaling_groups,
+                            ('AutoScalingGroupARN', 'AutoScalingGroupName')),
+    'launch_templates': ('ec2', iter_launch_templates, ('LaunchTemplateId', 'LaunchTemplateName')),
+    'scaling_policies': ('autoscaling', iter_scaling_policies, ('PolicyARN', 'PolicyName')),
+}
+
+READ_ONLY_PREFIXES = ('Describe', 'Get', 'List')
+
+
+def _tagged(item, params):
+    if 'Tags' not in item:
+        for spec in params.get('TagSpecifications') or []:
+            item['Tags'] = spec.get('Tags', [])
+    return item
+
+
+# operation -> (kind, items the call created, built from its params and response)
+CREATED = {
+    'CreateVpc': ('vpcs', lambda params, parsed: [_tagged(parsed['Vpc'], params)]),
+    'CreateSubnet': ('subnets', lambda params, parsed: [_tagged(parsed['Subnet'], params)]),
+    'CreateSecurityGroup': ('security_groups', lambda params, parsed: [_tagged({
+        'GroupId': parsed['GroupId'],
+        'GroupName': params['GroupName'],
+        'VpcId': params.get('VpcId'),
+        'IpPermissions': [],
+    }, params)]),
+    'RunInstances': ('instances', lambda params, parsed: [_tagged(item, params) for item in parsed['Instances']]),
+    'CreateImage': ('images', lambda params, parsed: [_tagged({
+        'ImageId': parsed['ImageId'],
+        'Name': params['Name'],
+    }, params)]),
+    'CreateKeyPair': ('key_pairs', lambda params, parsed: [{
+        'KeyPairId': parsed.get('KeyPairId'),
+        'KeyName': parsed['KeyName'],
+    }]),
+    'CreateTargetGroup': ('target_groups', lambda params, parsed: parsed['TargetGroups']),
+    'CreateLoadBalancer': ('load_balancers', lambda params, parsed: parsed['LoadBalancers']),
+    'CreateListener': ('listeners', lambda params, parsed: parsed['Listeners']),
+    'CreateLaunchConfiguration': ('launch_configurations', lambda params, parsed: [{
+        'LaunchConfigurationName': params['LaunchConfigurationName'],
+    }]),
+    'CreateAutoScalingGroup': ('auto_scaling_groups', lambda params, parsed: [{
+        'AutoScalingGroupName': params['AutoScalingGroupName'],
+        'MinSize': params['MinSize'],
+        'MaxSize': params['MaxSize'],
+        'TargetGroupARNs': params.get('TargetGroupARNs', []),
+        'LaunchTemplate': params.get('LaunchTemplate'),
+    }]),
+    'CreateLaunchTemplate': ('launch_templates', lambda params, parsed: [parsed['LaunchTemplate']]),
+    'PutScalingPolicy': ('scaling_policies', lambda params, parsed: [{
+        'PolicyARN': parsed.get('PolicyARN'),
+        'PolicyName': params['PolicyName'],
+        'AutoScalingGroupName': params['AutoScalingGroupName'],
+        'TargetTrackingConfiguration': params.get('TargetTrackingConfiguration'),
+    }]),
+}
+
+
+def tag_value(item, key):
+    for tag in item.get('Tags') or []:
+        if tag.get('Key') == key:
+            return tag.get('Value')
+    return None
+
+
+def name_tag(item):
+    return tag_value(item, 'Name')
+
+
+class Inventory:
+    """In-memory snapshot of the account, indexed per kind by id, ARN,
+    native name and Name tag."""
+
+    def __init__(self, resources=None, loaded_at=None):
+        self.resources = {kind: [] for kind in KINDS}
+        self.loaded_at = loaded_at if loaded_at is not None else time.time()
+        self.stale = False
+        self._handlers = []
+        self._lock = threading.Lock()
+        self._index = {kind: {} for kind in KINDS}
+        for kind, items in (resources or {}).items():
+            for item in items:
+                self.add(kind, item)
+
+    def add(self, kind, item):
+        with self._lock:
+            self.resources[kind].append(item)
+            keys = [item.get(field) for field in KINDS[kind][2]] + [name_tag(item)]
+            for key in dict.fromkeys(key for key in keys if key):
+                self._index[kind].setdefault(key, []).append(item)
+
+    def find(self, kind, key):
+        return list(self._index[kind].get(key, []))
+
+    def get(self, kind, key):
+        items = self._index[kind].get(key)
+        return items[0] if items else None
+
+    def select(self, kind, **fields):
+        return [item for item in self.resources[kind]
+                if all(item.get(field) == value for field, value in fields.items())]
+
+    def watch(self, client):
+        # Resources created through ``client`` are added to the index so that
+        # later checks in the same run see them. Any mutating call also means
+        # the snapshot may no longer match the account, so it must not be
+        # written back to disk.
+        def remember_params(params, context, **kwargs):
+            context['inventory_params'] = dict(params)
+
+        def record_call(model, parsed, context, **kwargs):
+            if model.name.startswith(READ_ONLY_PREFIXES):
+                return
+            self.stale = True
+            if model.name in CREATED and 'Error' not in parsed:
+                kind, created = CREATED[model.name]
+                for item in created(context.get('inventory_params', {}), parsed):
+                    self.add(kind, item)
+
+        handlers = [('before-parameter-build.*.*', remember_params), ('after-call.*.*', record_call)]
+        for event_name, handler in handlers:
+            client.meta.events.register(event_name, handler)
+        self._handlers.append((client, handlers))
+
+    def unwatch(self, client):
+        for watched, handlers in list(self._handlers):
+            if watched is client:
+                for event_name, handler in handlers:
+                    client.meta.events.unregister(event_name, handler)
+                self._handlers.remove((watched, handlers))
+
+    def save(self, path):
+        with open(path, 'w') as cache_file:
+            json.dump({'loaded_at': self.loaded_at, 'resources': self.resources}, cache_file, default=str)
+
+    def persist(self, path):
+        if self.stale:
+            if os.path.exists(path):
+                os.remove(path)
+        else:
+            self.save(path)
+
+    @classmethod
+    def from_cache(cls, path, ttl):
+        try:
+            with open(path) as cache_file:
+                data = json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+        if time.time() - data.get('loaded_at', 0) > ttl:
+            return None
+        return cls(data.get('resources'), loaded_at=data['loaded_at'])
+
+    @classmethod
+    async def load(cls, clients):
+        inventory = cls()
+        start = time.monotonic()
+        kinds = [(kind, loader(clients[service])) for kind, (service, loader, _) in KINDS.items() if loader]
+        loaded = dict(zip((kind for kind, _ in kinds), await asyncio.gather(*(collect(items) for _, items in kinds))))
+        loaded['listeners'] = [listener for listeners in await asyncio.gather(*(
+            collect(iter_listeners(clients['elbv2'], lb['LoadBalancerArn'])) for lb in loaded['load_balancers']
+        )) for listener in listeners]
+        for kind, items in loaded.items():
+            for item in items:
+                inventory.add(kind, item)
+        counts = ', '.join(f"{len(items)} {kind}" for kind, items in inventory.resources.items())
+        print(f"Inventory loaded in {time.monotonic() - start:.1f}s: {counts}")
+        return inventory
+
+
+async def load_inventory(clients, cache_path=None, ttl=600):
+    if cache_path:
+        inventory = Inventory.from_cache(cache_path, ttl)
+        if inventory is not None:
+            print(f"Using inventory cached {time.time() - inventory.loaded_at:.0f}s ago from {cache_path}")
+            return inventory
+    return await Inventory.load(clients)
@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from executor import Step
+
+# Step outputs a journal entry may be restored from, and the inventory kind
+# each must still exist as. None means there is nothing to check.
+RESTORABLE = {
+    'subnet_ids': 'subnets',
+    'key_pair': 'key_pairs',
+    'base_ami_id': None,
+    'ami_id': 'images',
+    'fleet_instance_ids': 'instances',
+    'target_group_arn': 'target_groups',
+    'load_balancer_arn': 'load_balancers',
+    'listener_arn': 'listeners',
+    'launch_template_id': 'launch_templates',
+    'auto_scaling_group': 'auto_scaling_groups',
+}
+
+
+def _canonical(value):
+    if isinstance(value, dict):
+        return {str(key): _canonical(item) for key, item in value.items()}
+    if isinstance(value, (set, frozenset)):
+        return sorted((_canonical(item) for item in value), key=repr)
+    if isinstance(value, (list, tuple)):
+        return [_canonical(item) for item in value]
+    return value
+
+
+def fingerprint(inputs):
+    encoded = json.dumps(_canonical(inputs), sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()[:16]
+
+
+def restorable(step):
+    return all(key in RESTORABLE for key in step.provides)
+
+
+class Journal:
+    """Local record of the steps a run completed, their outputs and a
+    fingerprint of their inputs, so that a failed run can be resumed."""
+
+    def __init__(self, path, steps=None, finished=True, planned=()):
+        self.path = path
+        self.finished = finished
+        self.planned = list(planned)
+        self.steps = dict(steps or {})
+        # Entries from the last run; ``steps`` is rewritten as this one goes.
+        self.previous = dict(self.steps)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path) as journal_file:
+                data = json.load(journal_file)
+        except (OSError, ValueError):
+            return cls(path)
+        return cls(path, data.get('steps'), data.get('finished', True), data.get('planned', ()))
+
+    def save(self):
+        # Written to a temporary file first so that a run killed mid-write
+        # never leaves a truncated journal behind.
+        temporary = f'{self.path}.tmp'
+        with open(temporary, 'w') as journal_file:
+            json.dump({'finished': self.finished, 'planned': self.planned, 'steps': self.steps}, journal_file,
+                      default=str)
+        os.replace(temporary, self.path)
+
+    def unfinished(self, steps):
+        """Names of the steps the last run set out to run but did not get to,
+        if it failed."""
+        if self.finished:
+            return set()
+        return {step.name for step in steps if step.name in self.planned and step.name not in self.previous}
+
+    def begin(self, steps):
+        with self._lock:
+            self.finished = False
+            self.planned = [step.name for step in steps]
+            for step in steps:
+                self.steps.pop(step.name, None)
+            self.save()
+
+    def finish(self):
+        with self._lock:
+            self.finished = True
+            self.save()
+
+    def record(self, name, inputs_digest, outputs):
+        with self._lock:
+            self.steps[name] = {'inputs': inputs_digest, 'outputs': _canonical(outputs), 'finished_at': time.time()}
+            self.save()
+
+    def _still_exists(self, outputs, inventory):
+        for key, value in outputs.items():
+            kind = RESTORABLE[key]
+            if kind is None:
+                continue
+            for resource_id in value if isinstance(value, list) else [value]:
+                if inventory.get(kind, resource_id) is None:
+                    return False
+        return True
+
+    def restore(self, step, inputs_digest, inventory):
+        entry = self.previous.get(step.name)
+        if not entry or entry['inputs'] != inputs_digest:
+            return None
+        outputs = entry['outputs']
+        if set(outputs) != set(step.provides) or not self._still_exists(outputs, inventory):
+            return None
+        return outputs
+
+    def wrap(self, step, inventory=None):
+        """``step`` recording its outputs when it completes. With an
+        ``inventory``, a restorable step whose inputs are unchanged since the
+        last run returns the recorded outputs instead, as long as the
+        resources they name still exist."""
+        async def run(**inputs):
+            inputs_digest = fingerprint(inputs)
+            outputs = None
+            if inventory is not None and restorable(step):
+                outputs = self.restore(step, inputs_digest, inventory)
+                if outputs is not None:
+                    print(f"Step {step.name} restored from the journal")
+            if outputs is None:
+                outputs = await step.func(**inputs) or {}
+            self.record(step.name, inputs_digest, outputs)
+            return outputs
+
+        return Step(step.name, run, step.requires, step.provides)
@@ -0,0 +1,150 @@
+import asyncio
+import http.client
+import json
+import math
+import socket
+import threading
+import time
+
+from readiness import poll_until
+
+# Where a route is sent: the load balancer's DNS name, or every fleet
+# instance's public IP in turn (the backends are not behind the ALB).
+TARGETS = ('load_balancer', 'instances')
+
+DEFAULT_ROUTES = [
+    {'name': 'frontend', 'target': 'load_balancer', 'port': 80, 'path': '/'},
+    {'name': 'hello /health', 'target': 'instances', 'port': 3001, 'path': '/health'},
+    {'name': 'profile /health', 'target': 'instances', 'port': 3002, 'path': '/health'},
+]
+
+# Routes that write to the services' databases. Only add them to a load test
+# of a stack whose MONGO_URL points at a test database.
+WRITE_ROUTES = [
+    {'name': 'profile /addUser', 'target': 'instances', 'port': 3002, 'path': '/addUser', 'method': 'POST',
+     'body': {'name': 'loadtest', 'age': 30}},
+]
+
+
+class LoadTestError(Exception):
+    pass
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+async def resolve(host, deadline):
+    """Wait until ``host`` resolves; a new ALB's DNS name takes a while to
+    propagate."""
+    async def lookup():
+        try:
+            return await asyncio.get_running_loop().getaddrinfo(host, None)
+        except socket.gaierror:
+            return None
+
+    await poll_until(lookup, deadline, f"{host} to resolve", initial=5, maximum=15)
+    return host
+
+
+def _worker(hosts, route, deadline, timeout, offset, samples, lock):
+    method = route.get('method', 'GET')
+    body = json.dumps(route['body']).encode() if 'body' in route else None
+    headers = {'Content-Type': 'application/json'} if body is not None else {}
+    connections = {}
+    latencies, errors, index = [], 0, offset
+
+    while time.monotonic() < deadline:
+        host = hosts[index % len(hosts)]
+        index += 1
+        # One keep-alive connection per host, reopened after any error.
+        connection = connections.get(host) or http.client.HTTPConnection(host, route['port'], timeout=timeout)
+        connections[host] = connection
+        start = time.monotonic()
+        try:
+            connection.request(method, route['path'], body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            ok = response.status < 400
+        except (http.client.HTTPException, OSError):
+            ok = False
+            connection.close()
+            connections.pop(host, None)
+        latencies.append(time.monotonic() - start)
+        if not ok:
+            errors += 1
+
+    for connection in connections.values():
+        connection.close()
+    with lock:
+        samples['latencies'].extend(latencies)
+        samples['errors'] += errors
+
+
+def run_route(hosts, route, concurrency=10, duration=30, timeout=5):
+    """Send ``route`` to ``hosts`` from ``concurrency`` workers for
+    ``duration`` seconds. Returns throughput and latency percentiles."""
+    samples = {'latencies': [], 'errors': 0}
+    lock = threading.Lock()
+    start = time.monotonic()
+    deadline = start + duration
+    workers = [threading.Thread(target=_worker, args=(hosts, route, deadline, timeout, offset, samples, lock))
+               for offset in range(concurrency)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.monotonic() - start
+
+    latencies = samples['latencies']
+    return {
+        'name': route['name'],
+        'requests': len(latencies),
+        'errors': samples['errors'],
+        'throughput': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+def slo_breaches(result, slo):
+    breaches = []
+    for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+        if key in slo and result[key] > slo[key]:
+            breaches.append(f"{result['name']}: {key[:-3]} {result[key]:.0f}ms over {slo[key]}ms")
+    error_rate = result['errors'] / result['requests'] if result['requests'] else 1.0
+    if error_rate > slo.get('max_error_rate', 0.0):
+        breaches.append(f"{result['name']}: {error_rate:.1%} of requests failed, "
+                        f"allowed {slo.get('max_error_rate', 0.0):.1%}")
+    return breaches
+
+
+def print_report(results):
+    print("Load test:")
+    print(f"  {'route':<24}{'requests':>9}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for result in results:
+        print(f"  {result['name']:<24}{result['requests']:>9}{result['errors']:>8}{result['throughput']:>9.1f}"
+              f"{result['p50_ms']:>9.0f}{result['p95_ms']:>9.0f}{result['p99_ms']:>9.0f}")
+
+
+def load_test(hosts, settings):
+    """Drive every route in ``settings`` in turn against ``hosts``, a dict of
+    target -> host names or addresses. Raises ``LoadTestError`` when a route
+    breaches its latency or error SLO."""
+    results, breaches = [], []
+    for route in settings.get('routes', DEFAULT_ROUTES):
+        if not hosts.get(route['target']):
+            raise LoadTestError(f"No {route['target']} to send {route['name']} to")
+        result = run_route(hosts[route['target']], route, settings['concurrency'], settings['duration'],
+                           settings['timeout'])
+        results.append(result)
+        breaches += slo_breaches(result, dict(settings['slo'], **route.get('slo', {})))
+    print_report(results)
+    if breaches:
+        raise LoadTestError(f"Latency SLO breached: {'; '.join(breaches)}")
+    return results
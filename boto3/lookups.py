@@ -0,0 +1,146 @@
+from botocore.exceptions import ClientError
+
+CANONICAL_OWNER_ID = '099720109477'
+
+
+async def paginate(client, operation, result_key, **kwargs):
+    """Yield items of ``result_key`` page by page, only fetching the next page
+    once the caller has consumed the current one."""
+    if client.can_paginate(operation):
+        async for page in client.get_paginator(operation).paginate(**kwargs):
+            for item in page.get(result_key, []):
+                yield item
+    else:
+        response = await getattr(client, operation)(**kwargs)
+        for item in response.get(result_key, []):
+            yield item
+
+
+def first(items):
+    return next(iter(items), None)
+
+
+async def first_async(items):
+    async for item in items:
+        return item
+    return None
+
+
+async def collect(items):
+    return [item async for item in items]
+
+
+def name_filter(name):
+    return {'Name': 'tag:Name', 'Values': [name]}
+
+
+async def _ignore_not_found(items, *codes):
+    try:
+        async for item in items:
+            yield item
+    except ClientError as e:
+        if e.response['Error']['Code'] not in codes:
+            raise
+
+
+def iter_vpcs(ec2_client, filters=()):
+    return paginate(ec2_client, 'describe_vpcs', 'Vpcs', Filters=list(filters))
+
+
+def iter_subnets(ec2_client, filters=()):
+    return paginate(ec2_client, 'describe_subnets', 'Subnets', Filters=list(filters))
+
+
+def iter_security_groups(ec2_client, filters=()):
+    return paginate(ec2_client, 'describe_security_groups', 'SecurityGroups', Filters=list(filters))
+
+
+async def iter_instances(ec2_client, filters=()):
+    async for reservation in paginate(ec2_client, 'describe_instances', 'Reservations', Filters=list(filters)):
+        for instance in reservation['Instances']:
+            yield instance
+
+
+def iter_images(ec2_client, filters=(), owners=()):
+    kwargs = {'Filters': list(filters)}
+    if owners:
+        kwargs['Owners'] = list(owners)
+    return paginate(ec2_client, 'describe_images', 'Images', **kwargs)
+
+
+def iter_internet_gateways(ec2_client, filters=()):
+    return paginate(ec2_client, 'describe_internet_gateways', 'InternetGateways', Filters=list(filters))
+
+
+def iter_route_tables(ec2_client, filters=()):
+    return paginate(ec2_client, 'describe_route_tables', 'RouteTables', Filters=list(filters))
+
+
+def iter_key_pairs(ec2_client, filters=()):
+    return paginate(ec2_client, 'describe_key_pairs', 'KeyPairs', Filters=list(filters))
+
+
+def iter_target_groups(elbv2_client, names=()):
+    kwargs = {'Names': list(names)} if names else {}
+    return _ignore_not_found(
+        paginate(elbv2_client, 'describe_target_groups', 'TargetGroups', **kwargs),
+        'TargetGroupNotFound'
+    )
+
+
+def iter_load_balancers(elbv2_client, names=()):
+    kwargs = {'Names': list(names)} if names else {}
+    return _ignore_not_found(
+        paginate(elbv2_client, 'describe_load_balancers', 'LoadBalancers', **kwargs),
+        'LoadBalancerNotFound'
+    )
+
+
+def iter_listeners(elbv2_client, load_balancer_arn):
+    return _ignore_not_found(
+        paginate(elbv2_client, 'describe_listeners', 'Listeners', LoadBalancerArn=load_balancer_arn),
+        'LoadBalancerNotFound'
+    )
+
+
+def iter_launch_configurations(asg_client, names=()):
+    kwargs = {'LaunchConfigurationNames': list(names)} if names else {}
+    return paginate(asg_client, 'describe_launch_configurations', 'LaunchConfigurations', **kwargs)
+
+
+def iter_auto_scaling_groups(asg_client, names=(), filters=()):
+    kwargs = {'AutoScalingGroupNames': list(names)} if names else {}
+    if filters:
+        kwargs['Filters'] = list(filters)
+    return paginate(asg_client, 'describe_auto_scaling_groups', 'AutoScalingGroups', **kwargs)
+
+
+def iter_launch_templates(ec2_client, names=(), filters=()):
+    kwargs = {'LaunchTemplateNames': list(names)} if names else {}
+    if filters:
+        kwargs['Filters'] = list(filters)
+    return _ignore_not_found(
+        paginate(ec2_client, 'describe_launch_templates', 'LaunchTemplates', **kwargs),
+        'InvalidLaunchTemplateName.NotFoundException'
+    )
+
+
+def iter_launch_template_versions(ec2_client, name):
+    return _ignore_not_found(
+        paginate(ec2_client, 'describe_launch_template_versions', 'LaunchTemplateVersions', LaunchTemplateName=name),
+        'InvalidLaunchTemplateName.NotFoundException'
+    )
+
+
+def iter_scaling_policies(asg_client, asg_name=None):
+    kwargs = {'AutoScalingGroupName': asg_name} if asg_name else {}
+    return paginate(asg_client, 'describe_policies', 'ScalingPolicies', **kwargs)
+
+
+async def iter_tags(elbv2_client, resource_arns):
+    """Yield ``(arn, {key: value})`` for each ARN, 20 ARNs per call."""
+    resource_arns = list(resource_arns)
+    for start in range(0, len(resource_arns), 20):
+        response = await elbv2_client.describe_tags(ResourceArns=resource_arns[start:start + 20])
+        for description in response['TagDescriptions']:
+            yield description['ResourceArn'], {tag['Key']: tag['Value'] for tag in description.get('Tags', [])}
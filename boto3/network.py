@@ -0,0 +1,29 @@
+import ipaddress
+from collections import namedtuple
+from itertools import islice
+
+Subnet = namedtuple('Subnet', ['subnet_id', 'availability_zone', 'cidr_block'])
+Network = namedtuple('Network', ['vpc_id', 'cidr_block', 'subnets', 'internet_gateway_id', 'route_table_id'])
+
+# Only regular zones; Local and Wavelength Zones cannot host an ALB.
+ZONE_FILTERS = [
+    {'Name': 'state', 'Values': ['available']},
+    {'Name': 'zone-type', 'Values': ['availability-zone']},
+]
+
+
+def zone_names(response):
+    return sorted(zone['ZoneName'] for zone in response['AvailabilityZones'])
+
+
+async def discover_availability_zones(ec2_client):
+    """Every available AZ of the client's region, in name order."""
+    return zone_names(await ec2_client.describe_availability_zones(Filters=ZONE_FILTERS))
+
+
+def subnet_cidrs(vpc_cidr, count, prefix=24):
+    """The first ``count`` non-overlapping /``prefix`` blocks of ``vpc_cidr``."""
+    cidrs = [str(cidr) for cidr in islice(ipaddress.ip_network(vpc_cidr).subnets(new_prefix=prefix), count)]
+    if len(cidrs) < count:
+        raise ValueError(f"{vpc_cidr} only has room for {len(cidrs)} /{prefix} subnets, {count} needed")
+    return cidrs
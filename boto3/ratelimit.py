@@ -0,0 +1,192 @@
+import asyncio
+import random
+import threading
+import time
+
+from inventory import READ_ONLY_PREFIXES
+from tracing import THROTTLING_CODES, _error_code
+
+# Requests per second each bucket starts at and may grow back to, per
+# (service, operation class). Kept below the published EC2 and ELB request
+# rate limits so other tooling in the account keeps some headroom.
+DEFAULT_RATES = {
+    ('ec2', 'describe'): 20.0,
+    ('ec2', 'mutate'): 5.0,
+    ('elasticloadbalancing', 'describe'): 10.0,
+    ('elasticloadbalancing', 'mutate'): 5.0,
+    ('autoscaling', 'describe'): 10.0,
+    ('autoscaling', 'mutate'): 4.0,
+}
+# How many calls each bucket lets through at once before pacing to its rate.
+# EC2 publishes its own buckets' capacities (100 describe, 50 mutating
+# calls); ELB and Auto Scaling do not, so theirs are kept at a few seconds'
+# worth of their rate.
+DEFAULT_BURSTS = {
+    ('ec2', 'describe'): 100.0,
+    ('ec2', 'mutate'): 50.0,
+    ('elasticloadbalancing', 'describe'): 40.0,
+    ('elasticloadbalancing', 'mutate'): 20.0,
+    ('autoscaling', 'describe'): 40.0,
+    ('autoscaling', 'mutate'): 16.0,
+}
+FALLBACK_RATE = 5.0
+MIN_RATE = 0.5
+
+# Used for clients without a retry configuration; otherwise throttles get as
+# many retries as botocore would give them, since it takes over once the
+# limiter stops retrying.
+MAX_THROTTLE_RETRIES = 8
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 20.0
+
+
+def operation_class(operation_name):
+    return 'describe' if operation_name.startswith(READ_ONLY_PREFIXES) else 'mutate'
+
+
+def max_retries(client):
+    """Retries botocore allows ``client`` per call."""
+    retries = client.meta.config.retries or {}
+    if 'total_max_attempts' in retries:
+        return retries['total_max_attempts'] - 1
+    return retries.get('max_attempts', MAX_THROTTLE_RETRIES)
+
+
+class TokenBucket:
+    """Token bucket whose rate halves on every throttle and creeps back up
+    towards ``max_rate`` as calls succeed."""
+
+    def __init__(self, rate, burst=None):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.throttles = 0
+        self.waited = 0.0
+        self.backed_off = 0.0
+
+    def _reserve(self):
+        # Take a token now, possibly going into debt; the caller sleeps off
+        # the debt outside the lock so other workers can queue up behind it.
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            self.calls += 1
+            self.waited += wait
+        return wait
+
+    def acquire(self):
+        wait = self._reserve()
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self):
+        wait = self._reserve()
+        if wait:
+            await asyncio.sleep(wait)
+        return wait
+
+    def throttled(self, backoff):
+        with self._lock:
+            self.rate = max(MIN_RATE, self.rate / 2)
+            self.throttles += 1
+            self.backed_off += backoff
+
+    def succeeded(self):
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class RateLimiter:
+    """Shares one token bucket per (service, region, operation class) between
+    every client it is attached to, and retries throttled calls itself with
+    full-jitter exponential backoff."""
+
+    def __init__(self, rates=None, bursts=None, rng=None):
+        self.rates = dict(DEFAULT_RATES, **(rates or {}))
+        self.bursts = dict(DEFAULT_BURSTS, **(bursts or {}))
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def configure(self, rates=None, bursts=None):
+        with self._lock:
+            self.rates.update(rates or {})
+            self.bursts.update(bursts or {})
+            self._buckets.clear()
+
+    def bucket(self, service, region, operation_name):
+        key = (service, region, operation_class(operation_name))
+        with self._lock:
+            if key not in self._buckets:
+                self._buckets[key] = TokenBucket(self.rates.get((service, key[2]), FALLBACK_RATE),
+                                                 self.bursts.get((service, key[2])))
+            return self._buckets[key]
+
+    def backoff(self, attempts):
+        return self._rng.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempts))
+
+    def attach(self, client, asynchronous=False):
+        """Limit and retry the calls ``client`` makes. aiobotocore clients
+        are attached with ``asynchronous`` so that waiting for a token does
+        not block their event loop."""
+        service_model = client.meta.service_model
+        service = service_model.endpoint_prefix
+        region = client.meta.region_name
+        service_event = service_model.service_id.hyphenize()
+        retry_limit = max_retries(client)
+
+        def before_send(request, event_name, **kwargs):
+            self.bucket(service, region, event_name.rsplit('.', 1)[-1]).acquire()
+
+        async def before_send_async(request, event_name, **kwargs):
+            await self.bucket(service, region, event_name.rsplit('.', 1)[-1]).acquire_async()
+
+        def needs_retry(response, operation, attempts, **kwargs):
+            if response is None or _error_code(response[1]) not in THROTTLING_CODES:
+                return None
+            if attempts > retry_limit:
+                # botocore's retry handler stops at the same attempt.
+                return None
+            delay = self.backoff(attempts)
+            self.bucket(service, region, operation.name).throttled(delay)
+            return delay
+
+        def after_call(parsed, model, **kwargs):
+            if _error_code(parsed) not in THROTTLING_CODES:
+                self.bucket(service, region, model.name).succeeded()
+
+        client.meta.events.register(f'before-send.{service_event}', before_send_async if asynchronous else before_send)
+        # Registered first on the service's own event so that throttles are
+        # retried here rather than by botocore's retry handler.
+        client.meta.events.register_first(f'needs-retry.{service_event}', needs_retry)
+        client.meta.events.register(f'after-call.{service_event}', after_call)
+
+    def lost_to_throttling(self):
+        with self._lock:
+            buckets = list(self._buckets.values())
+        return sum(bucket.backed_off for bucket in buckets)
+
+    def report(self):
+        with self._lock:
+            buckets = sorted(self._buckets.items())
+        throttled = [(key, bucket) for key, bucket in buckets if bucket.throttles or bucket.waited >= 0.5]
+        if not throttled:
+            return
+        print(f"Rate limiting: {self.lost_to_throttling():.1f}s lost backing off from throttles")
+        print(f"  {'bucket':<44}{'calls':>7}{'throttled':>10}{'waited s':>10}{'backoff s':>11}{'rate/s':>8}")
+        for (service, region, kind), bucket in throttled:
+            name = f"{service} {region} {kind}"
+            print(f"  {name:<44}{bucket.calls:>7}{bucket.throttles:>10}{bucket.waited:>10.1f}"
+                  f"{bucket.backed_off:>11.1f}{bucket.rate:>8.1f}")
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,119 @@
+import asyncio
+import time
+import urllib.error
+import urllib.request
+from functools import partial
+
+from botocore.exceptions import ClientError, WaiterError
+
+# The bootstrap script echoes one of these to /dev/console when it finishes so
+# that we can read the result back through get_console_output.
+USER_DATA_DONE_MARKER = 'MERN-BOOTSTRAP-COMPLETE'
+USER_DATA_FAILED_MARKER = 'MERN-BOOTSTRAP-FAILED'
+
+HEALTH_PORTS = (3001, 3002)
+DEFAULT_TIMEOUT = 600
+
+
+class ReadinessError(Exception):
+    pass
+
+
+def backoff_delays(initial=2, maximum=30, factor=2):
+    delay = initial
+    while True:
+        yield delay
+        delay = min(delay * factor, maximum)
+
+
+async def poll_until(check, deadline, description, initial=2, maximum=30):
+    """Await ``check()`` with growing pauses until it returns something
+    truthy, which is returned."""
+    for delay in backoff_delays(initial, maximum):
+        result = await check()
+        if result:
+            return result
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise ReadinessError(f"Timed out waiting for {description}")
+        await asyncio.sleep(min(delay, remaining))
+
+
+async def wait_for_status_ok(ec2_client, instance_ids, deadline, delay=15):
+    remaining = deadline - time.monotonic()
+    waiter = ec2_client.get_waiter('instance_status_ok')
+    try:
+        await waiter.wait(
+            InstanceIds=instance_ids,
+            WaiterConfig={'Delay': delay, 'MaxAttempts': max(1, int(remaining // delay))}
+        )
+    except WaiterError as e:
+        raise ReadinessError(f"Instances {', '.join(instance_ids)} did not pass status checks: {e}")
+
+
+async def user_data_finished(ec2_client, instance_id):
+    try:
+        response = await ec2_client.get_console_output(InstanceId=instance_id, Latest=True)
+    except ClientError as e:
+        print(f"An error occurred while reading console output of {instance_id}: {e}")
+        return False
+    output = response.get('Output') or ''
+    if USER_DATA_FAILED_MARKER in output:
+        raise ReadinessError(f"User data failed on instance {instance_id}")
+    return USER_DATA_DONE_MARKER in output
+
+
+async def get_public_ips(ec2_client, instance_ids):
+    addresses = {}
+    response = await ec2_client.describe_instances(InstanceIds=instance_ids)
+    for reservation in response['Reservations']:
+        for instance in reservation['Instances']:
+            if instance.get('PublicIpAddress'):
+                addresses[instance['InstanceId']] = instance['PublicIpAddress']
+    return addresses
+
+
+def _probe(url, timeout):
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return response.status == 200
+    except (urllib.error.URLError, OSError):
+        return False
+
+
+async def probe_health(host, port, path='/health', timeout=5):
+    return await asyncio.to_thread(_probe, f"http://{host}:{port}{path}", timeout)
+
+
+async def wait_for_instances_ready(ec2_client, instance_ids, timeout=DEFAULT_TIMEOUT, health_ports=HEALTH_PORTS,
+                                   check_marker=True):
+    """Wait until every instance passes its status checks, has finished
+    running user data and answers on each health port. The instances are
+    polled concurrently.
+
+    Raises ``ReadinessError`` as soon as bootstrap reports a failure or when
+    ``timeout`` seconds have passed.
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    print(f"Waiting up to {timeout}s for {', '.join(instance_ids)} to become ready...")
+
+    await wait_for_status_ok(ec2_client, instance_ids, deadline)
+
+    if check_marker:
+        await asyncio.gather(*(
+            poll_until(partial(user_data_finished, ec2_client, instance_id), deadline,
+                       f"user data to finish on {instance_id}")
+            for instance_id in instance_ids))
+
+    if health_ports:
+        addresses = await get_public_ips(ec2_client, instance_ids)
+        missing = set(instance_ids) - set(addresses)
+        if missing:
+            raise ReadinessError(f"Instances {', '.join(sorted(missing))} have no public IP to probe")
+        await asyncio.gather(*(
+            poll_until(partial(probe_health, address, port), deadline,
+                       f"http://{address}:{port}/health on {instance_id}")
+            for instance_id, address in addresses.items() for port in health_ports))
+
+    print(f"Instances {', '.join(instance_ids)} ready after {time.monotonic() - start:.0f}s")
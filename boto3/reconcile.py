@@ -0,0 +1,173 @@
+from collections import namedtuple
+
+from bakes import BAKE_FAMILY_TAG, matches_bake
+from fleet import FLEET_INSTANCE_STATES
+from inventory import tag_value
+from scaling import policy_matches, scaling_policies
+
+# step is the name of the provisioning step that carries the action out.
+Action = namedtuple('Action', ['kind', 'name', 'op', 'step', 'detail'])
+
+SYMBOLS = {'create': '+', 'update': '~', 'noop': '='}
+
+
+def desired_state(config):
+    return [
+        ('vpc', config['vpc_name'], 'network', {}),
+        ('security_group', config['security_group_name'], 'security_group_rules',
+         {'ports': set(config['required_ports'])}),
+        ('key_pair', config['key_pair_name'], 'key_pair', {}),
+        ('image', config['ami_name'], 'bake_ami',
+         {'user_data': config['user_data'], 'instance_type': config['instance_type']}),
+        ('fleet', config['fleet_name'], 'fleet', {'size': config['fleet_size']}),
+        ('target_group', config['target_group_name'], 'target_group', {}),
+        ('targets', config['target_group_name'], 'register_targets', {}),
+        ('load_balancer', config['lb_name'], 'load_balancer', {}),
+        ('listener', config['lb_name'], 'listener', {}),
+        ('launch_template', config['launch_template_name'], 'launch_template', {}),
+        ('auto_scaling_group', config['asg_name'], 'auto_scaling_group',
+         {'capacity': config['asg_capacity'], 'target_group': config['target_group_name'],
+          'launch_template': config['launch_template_name']}),
+        ('scaling_policies', config['asg_name'], 'scaling_policies',
+         {'targets': config['scaling_targets'], 'target_group': config['target_group_name']}),
+        ('warm_pool', config['asg_name'], 'warm_pool', {'warm_pool': config['warm_pool']}),
+    ]
+
+
+def _security_group_ports(inventory, vpc, name):
+    for sg in inventory.select('security_groups', VpcId=vpc['VpcId'], GroupName=name):
+        return {rule.get('FromPort') for rule in sg['IpPermissions'] if rule.get('FromPort') == rule.get('ToPort')}
+    return None
+
+
+def _fleet_count(inventory, name):
+    return sum(1 for instance in inventory.find('instances', name) if instance['State']['Name'] in FLEET_INSTANCE_STATES)
+
+
+def diff(desired, inventory):
+    vpc = None
+    load_balancer = None
+    actions = []
+    created = set()
+
+    for kind, name, step, attributes in desired:
+        op, detail = 'noop', ''
+        if kind == 'vpc':
+            vpc = inventory.get('vpcs', name)
+            op = 'noop' if vpc else 'create'
+        elif kind == 'security_group':
+            current_ports = _security_group_ports(inventory, vpc, name) if vpc else None
+            if current_ports is None:
+                op, detail = 'create', f"ports {sorted(attributes['ports'])}"
+            elif current_ports != attributes['ports']:
+                added = sorted(attributes['ports'] - current_ports)
+                removed = sorted(port for port in current_ports - attributes['ports'] if port is not None)
+                op, detail = 'update', f"add ports {added}, remove ports {removed}"
+        elif kind == 'key_pair':
+            op = 'noop' if inventory.get('key_pairs', name) else 'create'
+        elif kind == 'fleet':
+            count = _fleet_count(inventory, name)
+            if count == 0:
+                op, detail = 'create', f"{attributes['size']} instances"
+            elif count < attributes['size']:
+                op, detail = 'update', f"launch {attributes['size'] - count} more"
+                created.add(kind)
+        elif kind == 'image':
+            baked = any(tag_value(image, BAKE_FAMILY_TAG) == name
+                        and matches_bake(image, attributes['user_data'], attributes['instance_type'])
+                        for image in inventory.resources['images'])
+            op = 'noop' if baked else 'create'
+        elif kind == 'target_group':
+            op = 'noop' if inventory.get('target_groups', name) else 'create'
+        elif kind == 'targets':
+            if created & {'fleet', 'target_group'}:
+                op, detail = 'update', 'register new instances'
+        elif kind == 'load_balancer':
+            load_balancer = inventory.get('load_balancers', name)
+            op = 'noop' if load_balancer else 'create'
+        elif kind == 'listener':
+            exists = load_balancer and inventory.get('listeners', load_balancer['LoadBalancerArn'])
+            op = 'noop' if exists else 'create'
+        elif kind == 'launch_template':
+            op = 'noop' if inventory.get('launch_templates', name) else 'create'
+        elif kind == 'auto_scaling_group':
+            group = inventory.get('auto_scaling_groups', name)
+            capacity = attributes['capacity']
+            target_group = inventory.get('target_groups', attributes['target_group'])
+            launch_template = inventory.get('launch_templates', attributes['launch_template'])
+            current_template = (group or {}).get('LaunchTemplate') or {}
+            if not group:
+                op = 'create'
+            elif (group.get('MinSize'), group.get('MaxSize')) != (capacity['min'], capacity['max']):
+                op, detail = 'update', f"min {capacity['min']}, max {capacity['max']}"
+            elif not target_group or target_group['TargetGroupArn'] not in group.get('TargetGroupARNs', []):
+                op, detail = 'update', f"attach target group {attributes['target_group']}"
+            elif not launch_template or current_template.get('LaunchTemplateId') != launch_template['LaunchTemplateId']:
+                op, detail = 'update', f"launch from launch template {attributes['launch_template']}"
+                if not current_template and group.get('LaunchConfigurationName'):
+                    detail = (f"move from launch configuration {group['LaunchConfigurationName']} "
+                              f"to launch template {attributes['launch_template']}")
+            elif current_template.get('Version') != str(launch_template.get('DefaultVersionNumber')):
+                op, detail = 'update', f"launch template version {launch_template.get('DefaultVersionNumber')}"
+        elif kind == 'scaling_policies':
+            target_group = inventory.get('target_groups', attributes['target_group'])
+            if not (load_balancer and target_group):
+                op = 'create'
+            else:
+                policies = scaling_policies(name, load_balancer['LoadBalancerArn'], target_group['TargetGroupArn'],
+                                            attributes['targets'])
+                changed = [policy_name for policy_name, configuration in policies.items()
+                           if not policy_matches(inventory.get('scaling_policies', policy_name), configuration)]
+                if changed:
+                    op, detail = 'update', ', '.join(changed)
+        elif kind == 'warm_pool':
+            group = inventory.get('auto_scaling_groups', name) or {}
+            current = group.get('WarmPoolConfiguration') or {}
+            desired = attributes['warm_pool']
+            if desired and (current.get('MinSize'), current.get('PoolState')) != (desired['min_size'], desired['pool_state']):
+                op, detail = 'update', f"{desired['min_size']} {desired['pool_state'].lower()} instances"
+            elif not desired and current:
+                op, detail = 'update', 'remove'
+
+        if op == 'create':
+            created.add(kind)
+        actions.append(Action(kind, name, op, step, detail))
+
+    return Plan(actions)
+
+
+class Plan:
+
+    def __init__(self, actions):
+        self.actions = actions
+
+    @property
+    def changes(self):
+        return [action for action in self.actions if action.op != 'noop']
+
+    def summary(self):
+        counts = {op: sum(1 for action in self.actions if action.op == op) for op in SYMBOLS}
+        return f"{counts['create']} to create, {counts['update']} to update, {counts['noop']} unchanged"
+
+    def print(self):
+        print(f"Plan: {self.summary()}")
+        for action in self.actions:
+            line = f"  {SYMBOLS[action.op]} {action.kind} {action.name}"
+            if action.detail:
+                line += f" ({action.detail})"
+            print(line)
+
+    def prune_steps(self, steps, include=()):
+        """Keep the steps that carry out a change or are named in ``include``,
+        plus whatever they need."""
+        providers = {key: step for step in steps for key in step.provides}
+        changed = {action.step for action in self.changes} | set(include)
+        keep = set()
+        stack = [step for step in steps if step.name in changed]
+        while stack:
+            step = stack.pop()
+            if step.name in keep:
+                continue
+            keep.add(step.name)
+            stack.extend(providers[key] for key in step.requires if key in providers)
+        return [step for step in steps if step.name in keep]
@@ -0,0 +1,182 @@
+import math
+import time
+
+from botocore.exceptions import ClientError
+
+from readiness import ReadinessError, poll_until
+from userdata import encode_user_data
+
+REFRESH_DONE = 'Successful'
+REFRESH_FAILED = ('Failed', 'Cancelled', 'RollbackSuccessful', 'RollbackFailed')
+# The group launches the template's default version, which only moves once a
+# refresh succeeds, so a rolled back refresh leaves it on the old one. It is
+# pinned by number: RollbackInstanceRefresh refuses groups on $Default or
+# $Latest.
+DEFAULT_VERSION = '$Default'
+
+
+class RolloutError(Exception):
+    pass
+
+
+async def configure_draining(elbv2_client, target_group_arn, deregistration_delay, slow_start):
+    """Give deregistered targets time to finish in-flight requests and ramp
+    new ones up gradually. Only calls the API when something differs."""
+    desired = {
+        'deregistration_delay.timeout_seconds': str(deregistration_delay),
+        'slow_start.duration_seconds': str(slow_start),
+    }
+    response = await elbv2_client.describe_target_group_attributes(TargetGroupArn=target_group_arn)
+    current = {attribute['Key']: attribute['Value'] for attribute in response['Attributes']}
+    changed = [{'Key': key, 'Value': value} for key, value in desired.items() if current.get(key) != value]
+    if changed:
+        await elbv2_client.modify_target_group_attributes(TargetGroupArn=target_group_arn, Attributes=changed)
+        print(f"Target group draining set to {deregistration_delay}s, slow start {slow_start}s.")
+
+
+async def ensure_template_version(ec2_client, launch_template_id, ami_id, user_data_script):
+    """Returns ``(version, created)``: the default launch template version if
+    it already launches ``ami_id`` with ``user_data_script``, otherwise a new
+    one based on it."""
+    user_data = encode_user_data(user_data_script)
+    default = (await ec2_client.describe_launch_template_versions(
+        LaunchTemplateId=launch_template_id, Versions=[DEFAULT_VERSION]
+    ))['LaunchTemplateVersions'][0]
+    data = default.get('LaunchTemplateData', {})
+    if data.get('ImageId') == ami_id and data.get('UserData') == user_data:
+        return default['VersionNumber'], False
+
+    response = await ec2_client.create_launch_template_version(
+        LaunchTemplateId=launch_template_id,
+        SourceVersion=str(default['VersionNumber']),
+        VersionDescription=f'{ami_id}',
+        LaunchTemplateData={'ImageId': ami_id, 'UserData': user_data}
+    )
+    version = response['LaunchTemplateVersion']['VersionNumber']
+    print(f"Launch template {launch_template_id} version {version} uses {ami_id}.")
+    return version, True
+
+
+async def start_refresh(asg_client, asg_name, launch_template_id, version, min_healthy_percentage, instance_warmup):
+    response = await asg_client.start_instance_refresh(
+        AutoScalingGroupName=asg_name,
+        Strategy='Rolling',
+        DesiredConfiguration={
+            'LaunchTemplate': {'LaunchTemplateId': launch_template_id, 'Version': str(version)},
+        },
+        Preferences={
+            'MinHealthyPercentage': min_healthy_percentage,
+            'InstanceWarmup': instance_warmup,
+            'SkipMatching': True,
+        }
+    )
+    print(f"Instance refresh {response['InstanceRefreshId']} started on {asg_name}.")
+    return response['InstanceRefreshId']
+
+
+async def refresh_status(asg_client, asg_name, refresh_id):
+    refreshes = (await asg_client.describe_instance_refreshes(
+        AutoScalingGroupName=asg_name, InstanceRefreshIds=[refresh_id]
+    ))['InstanceRefreshes']
+    return refreshes[0] if refreshes else {}
+
+
+async def describe_group(asg_client, asg_name):
+    return (await asg_client.describe_auto_scaling_groups(AutoScalingGroupNames=[asg_name]))['AutoScalingGroups'][0]
+
+
+async def healthy_targets(elbv2_client, target_group_arn, instance_ids):
+    """Healthy targets among ``instance_ids``; the target group also serves
+    instances that are not in the auto scaling group."""
+    response = await elbv2_client.describe_target_health(TargetGroupArn=target_group_arn)
+    return sum(1 for target in response['TargetHealthDescriptions']
+               if target['Target']['Id'] in instance_ids and target['TargetHealth']['State'] == 'healthy')
+
+
+def required_healthy(group, min_healthy_percentage):
+    return math.ceil(group['DesiredCapacity'] * min_healthy_percentage / 100)
+
+
+async def default_version(ec2_client, launch_template_id):
+    """The number of the launch template's default version, as a string."""
+    template = (await ec2_client.describe_launch_templates(
+        LaunchTemplateIds=[launch_template_id]
+    ))['LaunchTemplates'][0]
+    return str(template['DefaultVersionNumber'])
+
+
+async def pin_version(asg_client, asg_name, launch_template_id, version):
+    await asg_client.update_auto_scaling_group(
+        AutoScalingGroupName=asg_name,
+        LaunchTemplate={'LaunchTemplateId': launch_template_id, 'Version': str(version)}
+    )
+
+
+async def roll_back(asg_client, asg_name, reason):
+    print(f"Rolling back {asg_name}: {reason}")
+    try:
+        await asg_client.rollback_instance_refresh(AutoScalingGroupName=asg_name)
+    except ClientError as e:
+        # The refresh may already have ended; cancel whatever is left.
+        print(f"An error occurred while rolling back: {e}")
+        try:
+            await asg_client.cancel_instance_refresh(AutoScalingGroupName=asg_name)
+        except ClientError:
+            pass
+    raise RolloutError(f"Rollout of {asg_name} rolled back: {reason}")
+
+
+async def watch_refresh(asg_client, elbv2_client, asg_name, refresh_id, target_group_arn, min_healthy_percentage,
+                        timeout=3600, unhealthy_grace=120):
+    """Follow an instance refresh, rolling it back if it fails or if the
+    group's instances stay below the healthy minimum in the target group for
+    longer than ``unhealthy_grace``."""
+    deadline = time.monotonic() + timeout
+    unhealthy_since = None
+
+    async def finished():
+        nonlocal unhealthy_since
+        refresh = await refresh_status(asg_client, asg_name, refresh_id)
+        status = refresh.get('Status')
+        if status == REFRESH_DONE:
+            return True
+        if status in REFRESH_FAILED:
+            await roll_back(asg_client, asg_name, f"instance refresh {refresh_id} ended as {status}: {refresh.get('StatusReason', '')}")
+
+        group = await describe_group(asg_client, asg_name)
+        members = {instance['InstanceId'] for instance in group.get('Instances', [])}
+        healthy = await healthy_targets(elbv2_client, target_group_arn, members)
+        required = required_healthy(group, min_healthy_percentage)
+        print(f"Instance refresh {refresh_id}: {status}, {refresh.get('PercentageComplete', 0)}% done, "
+              f"{healthy} healthy targets (need {required})")
+        if healthy >= required:
+            unhealthy_since = None
+        elif unhealthy_since is None:
+            unhealthy_since = time.monotonic()
+        elif time.monotonic() - unhealthy_since > unhealthy_grace:
+            await roll_back(asg_client, asg_name, f"only {healthy} healthy targets for over {unhealthy_grace}s")
+        return False
+
+    try:
+        await poll_until(finished, deadline, f"instance refresh {refresh_id}", initial=15, maximum=30)
+    except ReadinessError as e:
+        await roll_back(asg_client, asg_name, str(e))
+
+
+async def roll_out(ec2_client, elbv2_client, asg_client, asg_name, launch_template_id, ami_id, user_data_script,
+                   target_group_arn, settings):
+    """Replace the group's instances with ones launched from ``ami_id``.
+    Returns the launch template version that is now live."""
+    await configure_draining(elbv2_client, target_group_arn, settings['deregistration_delay'], settings['slow_start'])
+    version, created = await ensure_template_version(ec2_client, launch_template_id, ami_id, user_data_script)
+    refresh_id = await start_refresh(asg_client, asg_name, launch_template_id, version,
+                                     settings['min_healthy_percentage'], settings['instance_warmup'])
+    await watch_refresh(asg_client, elbv2_client, asg_name, refresh_id, target_group_arn,
+                        settings['min_healthy_percentage'], settings['timeout'], settings['unhealthy_grace'])
+    if created:
+        await ec2_client.modify_launch_template(LaunchTemplateId=launch_template_id, DefaultVersion=str(version))
+    # The refresh already moved the group to ``version``; pin it explicitly in
+    # case the group was still on a symbolic version before.
+    await pin_version(asg_client, asg_name, launch_template_id, version)
+    print(f"Instance refresh {refresh_id} finished; {asg_name} runs launch template version {version}.")
+    return version
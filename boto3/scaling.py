@@ -0,0 +1,40 @@
+from batching import tag_specifications
+from userdata import encode_user_data
+
+
+def launch_template_data(ami_id, instance_type, key_name, security_group_id, user_data_script, name):
+    return {
+        'ImageId': ami_id,
+        'InstanceType': instance_type,
+        'KeyName': key_name,
+        'SecurityGroupIds': [security_group_id],
+        'UserData': encode_user_data(user_data_script),
+        'TagSpecifications': tag_specifications('instance', name),
+    }
+
+
+def resource_label(load_balancer_arn, target_group_arn):
+    # app/<lb-name>/<lb-id>/targetgroup/<tg-name>/<tg-id>
+    return f"{load_balancer_arn.split(':loadbalancer/', 1)[-1]}/{target_group_arn.split(':')[-1]}"
+
+
+def scaling_policies(asg_name, load_balancer_arn, target_group_arn, targets):
+    return {
+        f'{asg_name}-requests-per-target': {
+            'PredefinedMetricSpecification': {
+                'PredefinedMetricType': 'ALBRequestCountPerTarget',
+                'ResourceLabel': resource_label(load_balancer_arn, target_group_arn),
+            },
+            'TargetValue': float(targets['requests_per_target']),
+        },
+        f'{asg_name}-cpu': {
+            'PredefinedMetricSpecification': {'PredefinedMetricType': 'ASGAverageCPUUtilization'},
+            'TargetValue': float(targets['cpu_percent']),
+        },
+    }
+
+
+def policy_matches(policy, configuration):
+    current = (policy or {}).get('TargetTrackingConfiguration') or {}
+    return (current.get('TargetValue') == configuration['TargetValue']
+            and current.get('PredefinedMetricSpecification') == configuration['PredefinedMetricSpecification'])
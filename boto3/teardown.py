@@ -0,0 +1,302 @@
+import asyncio
+import os
+import time
+from collections import namedtuple
+from functools import partial
+
+from botocore.exceptions import ClientError, WaiterError
+
+from bakes import delete_image
+from batching import call_savings
+from executor import Step, StepFailed, run_steps
+from inventory import LIVE_INSTANCE_STATES, name_tag
+from lookups import (collect, first_async, iter_auto_scaling_groups, iter_images, iter_instances, iter_internet_gateways, iter_key_pairs,
+                     iter_launch_templates, iter_load_balancers, iter_route_tables, iter_security_groups, iter_subnets,
+                     iter_tags, iter_target_groups, iter_vpcs)
+from readiness import ReadinessError, poll_until
+from tracing import tracer
+
+STACK_TAG = 'mern:stack'
+ASG_MEMBER_TAG = 'aws:autoscaling:groupName'
+
+# Errors that clear up once whatever still uses the resource is gone, e.g. an
+# ALB's network interfaces lingering for a minute after the ALB is deleted.
+DEPENDENCY_CODES = ('DependencyViolation', 'ResourceInUse', 'ResourceInUseFault')
+
+# kind -> kinds that must be fully deleted before it can be.
+DELETE_AFTER = {
+    'auto_scaling_groups': (),
+    'load_balancers': (),
+    'instances': (),
+    'images': (),
+    'key_pairs': (),
+    'route_tables': (),
+    'target_groups': ('auto_scaling_groups', 'load_balancers'),
+    'launch_templates': ('auto_scaling_groups',),
+    'security_groups': ('auto_scaling_groups', 'load_balancers', 'instances'),
+    'internet_gateways': ('auto_scaling_groups', 'load_balancers', 'instances'),
+    'subnets': ('auto_scaling_groups', 'load_balancers', 'instances', 'route_tables'),
+    'vpcs': ('subnets', 'security_groups', 'internet_gateways', 'route_tables'),
+}
+
+# Kinds deleted with one call for all of their resources.
+BATCHED = ('instances',)
+
+Resource = namedtuple('Resource', ['kind', 'id', 'name', 'item'])
+
+
+def stack_tags(stack):
+    return {STACK_TAG: stack}
+
+
+def stack_filter(stack):
+    return {'Name': f'tag:{STACK_TAG}', 'Values': [stack]}
+
+
+async def _tagged_arns(elbv2_client, items, arn_field, stack):
+    items = {item[arn_field]: item async for item in items}
+    return [items[arn] async for arn, tags in iter_tags(elbv2_client, items) if tags.get(STACK_TAG) == stack]
+
+
+async def _stack_instances(ec2_client, stack):
+    # Instances launched by the auto scaling group go away with the group.
+    instances = iter_instances(ec2_client, [stack_filter(stack),
+                                            {'Name': 'instance-state-name', 'Values': LIVE_INSTANCE_STATES}])
+    return [instance async for instance in instances
+            if not any(tag['Key'] == ASG_MEMBER_TAG for tag in instance.get('Tags') or [])]
+
+
+# kind -> (client, loader, id field)
+DISCOVERY = {
+    'vpcs': ('ec2', lambda client, stack: iter_vpcs(client, [stack_filter(stack)]), 'VpcId'),
+    'subnets': ('ec2', lambda client, stack: iter_subnets(client, [stack_filter(stack)]), 'SubnetId'),
+    'security_groups': ('ec2', lambda client, stack: iter_security_groups(client, [stack_filter(stack)]), 'GroupId'),
+    'internet_gateways': ('ec2', lambda client, stack: iter_internet_gateways(client, [stack_filter(stack)]),
+                          'InternetGatewayId'),
+    'route_tables': ('ec2', lambda client, stack: iter_route_tables(client, [stack_filter(stack)]), 'RouteTableId'),
+    'instances': ('ec2', _stack_instances, 'InstanceId'),
+    'images': ('ec2', lambda client, stack: iter_images(client, [stack_filter(stack)], owners=['self']), 'ImageId'),
+    'key_pairs': ('ec2', lambda client, stack: iter_key_pairs(client, [stack_filter(stack)]), 'KeyName'),
+    'launch_templates': ('ec2', lambda client, stack: iter_launch_templates(client, filters=[stack_filter(stack)]),
+                         'LaunchTemplateId'),
+    'load_balancers': ('elbv2', lambda client, stack: _tagged_arns(client, iter_load_balancers(client),
+                                                                   'LoadBalancerArn', stack), 'LoadBalancerArn'),
+    'target_groups': ('elbv2', lambda client, stack: _tagged_arns(client, iter_target_groups(client),
+                                                                  'TargetGroupArn', stack), 'TargetGroupArn'),
+    'auto_scaling_groups': ('autoscaling', lambda client, stack: iter_auto_scaling_groups(client, filters=[stack_filter(stack)]),
+                            'AutoScalingGroupName'),
+}
+
+
+def _label(item):
+    return (name_tag(item) or item.get('LoadBalancerName') or item.get('TargetGroupName')
+            or item.get('LaunchTemplateName') or item.get('AutoScalingGroupName') or item.get('Name') or '')
+
+
+async def _load(items):
+    # DISCOVERY loaders return either a lookup to drain or a coroutine.
+    if hasattr(items, '__aiter__'):
+        return await collect(items)
+    return await items
+
+
+async def discover(clients, stack):
+    """Every resource tagged with ``stack``, in the order the kinds appear in
+    ``DISCOVERY``."""
+    found = await asyncio.gather(*(_load(loader(clients[service], stack))
+                                   for service, loader, _ in DISCOVERY.values()))
+    return [Resource(kind, item[id_field], _label(item), item)
+            for (kind, (_, _, id_field)), items in zip(DISCOVERY.items(), found) for item in items]
+
+
+def _not_found(error):
+    return 'NotFound' in error.response['Error']['Code']
+
+
+async def _until_free(call, deadline, description):
+    """Retry ``call`` while AWS reports the resource as still in use."""
+    async def attempt():
+        try:
+            await call()
+        except ClientError as e:
+            if e.response['Error']['Code'] not in DEPENDENCY_CODES:
+                raise
+            return False
+        return True
+
+    await poll_until(attempt, deadline, description, initial=5, maximum=15)
+
+
+async def _wait(client, waiter_name, deadline, delay=5, **kwargs):
+    attempts = max(1, int((deadline - time.monotonic()) // delay))
+    with tracer.span(f'wait:{waiter_name}', category='wait'):
+        await client.get_waiter(waiter_name).wait(WaiterConfig={'Delay': delay, 'MaxAttempts': attempts}, **kwargs)
+
+
+async def delete_auto_scaling_groups(clients, resources, deadline):
+    name = resources[0].id
+    # ForceDelete terminates the group's instances along with it.
+    await clients['autoscaling'].delete_auto_scaling_group(AutoScalingGroupName=name, ForceDelete=True)
+
+    async def gone():
+        return await first_async(iter_auto_scaling_groups(clients['autoscaling'], [name])) is None
+
+    # Auto Scaling has no waiter for this, so poll until the group is gone.
+    with tracer.span('wait:group_deleted', category='wait'):
+        await poll_until(gone, deadline, f"auto scaling group {name} to be deleted", initial=5, maximum=15)
+
+
+async def delete_load_balancers(clients, resources, deadline):
+    arn = resources[0].id
+    await clients['elbv2'].delete_load_balancer(LoadBalancerArn=arn)
+    await _wait(clients['elbv2'], 'load_balancers_deleted', deadline, LoadBalancerArns=[arn])
+
+
+async def delete_instances(clients, resources, deadline):
+    instance_ids = [resource.id for resource in resources]
+    await clients['ec2'].terminate_instances(InstanceIds=instance_ids)
+    call_savings.record('terminate_instances', 1, len(instance_ids))
+    await _wait(clients['ec2'], 'instance_terminated', deadline, InstanceIds=instance_ids)
+
+
+async def delete_images(clients, resources, deadline):
+    await delete_image(clients['ec2'], resources[0].item)
+
+
+async def delete_key_pairs(clients, resources, deadline):
+    await clients['ec2'].delete_key_pair(KeyName=resources[0].id)
+
+
+async def delete_route_tables(clients, resources, deadline):
+    route_table = resources[0].item
+    for association in route_table.get('Associations') or []:
+        if not association.get('Main'):
+            await clients['ec2'].disassociate_route_table(AssociationId=association['RouteTableAssociationId'])
+    await clients['ec2'].delete_route_table(RouteTableId=route_table['RouteTableId'])
+
+
+async def delete_target_groups(clients, resources, deadline):
+    arn = resources[0].id
+    await _until_free(partial(clients['elbv2'].delete_target_group, TargetGroupArn=arn), deadline,
+                      f"target group {arn} to be released")
+
+
+async def delete_launch_templates(clients, resources, deadline):
+    await clients['ec2'].delete_launch_template(LaunchTemplateId=resources[0].id)
+
+
+async def delete_security_groups(clients, resources, deadline):
+    group_id = resources[0].id
+    await _until_free(partial(clients['ec2'].delete_security_group, GroupId=group_id), deadline,
+                      f"security group {group_id} to be released")
+
+
+async def delete_internet_gateways(clients, resources, deadline):
+    gateway = resources[0].item
+    gateway_id = gateway['InternetGatewayId']
+    for attachment in gateway.get('Attachments') or []:
+        await _until_free(partial(clients['ec2'].detach_internet_gateway, InternetGatewayId=gateway_id,
+                                  VpcId=attachment['VpcId']),
+                          deadline, f"internet gateway {gateway_id} to detach")
+    await clients['ec2'].delete_internet_gateway(InternetGatewayId=gateway_id)
+
+
+async def delete_subnets(clients, resources, deadline):
+    subnet_id = resources[0].id
+    await _until_free(partial(clients['ec2'].delete_subnet, SubnetId=subnet_id), deadline,
+                      f"subnet {subnet_id} to be released")
+
+
+async def delete_vpcs(clients, resources, deadline):
+    vpc_id = resources[0].id
+    await _until_free(partial(clients['ec2'].delete_vpc, VpcId=vpc_id), deadline, f"VPC {vpc_id} to be released")
+
+
+DELETERS = {
+    'auto_scaling_groups': delete_auto_scaling_groups,
+    'load_balancers': delete_load_balancers,
+    'instances': delete_instances,
+    'images': delete_images,
+    'key_pairs': delete_key_pairs,
+    'route_tables': delete_route_tables,
+    'target_groups': delete_target_groups,
+    'launch_templates': delete_launch_templates,
+    'security_groups': delete_security_groups,
+    'internet_gateways': delete_internet_gateways,
+    'subnets': delete_subnets,
+    'vpcs': delete_vpcs,
+}
+
+
+def _deleted(kind, resource_id):
+    return f'deleted:{kind}:{resource_id}'
+
+
+async def _delete(clients, kind, resources, deadline, key, **deleted):
+    # ``deleted`` holds the markers of the deletions this one waited for.
+    try:
+        await DELETERS[kind](clients, resources, deadline)
+    except ClientError as e:
+        if not _not_found(e):
+            raise StepFailed(f"Failed to delete {kind} {', '.join(resource.id for resource in resources)}: {e}")
+    except (WaiterError, ReadinessError) as e:
+        raise StepFailed(str(e))
+    for resource in resources:
+        print(f"Deleted {kind} {resource.id} {resource.name}".rstrip())
+    return {key: True}
+
+
+def build_steps(clients, resources, timeout):
+    """One step per resource, or per kind for ``BATCHED`` kinds, each
+    starting once everything it depends on is gone."""
+    deadline = time.monotonic() + timeout
+    groups = {}
+    for resource in resources:
+        group_id = '*' if resource.kind in BATCHED else resource.id
+        groups.setdefault((resource.kind, group_id), []).append(resource)
+
+    steps = []
+    for (kind, group_id), members in groups.items():
+        requires = [_deleted(other_kind, other_id) for other_kind, other_id in groups
+                    if other_kind in DELETE_AFTER[kind]]
+        key = _deleted(kind, group_id)
+        name = f'delete {kind}' if group_id == '*' else f'delete {kind} {group_id}'
+        steps.append(Step(name, partial(_delete, clients, kind, members, deadline, key),
+                          requires=requires, provides=(key,)))
+    return steps
+
+
+def print_plan(stack, resources):
+    print(f"Destroy plan for stack {stack}: {len(resources)} to delete")
+    for resource in resources:
+        line = f"  - {resource.kind} {resource.id}"
+        if resource.name:
+            line += f" ({resource.name})"
+        print(line)
+
+
+async def destroy(config, clients, plan_only=False):
+    """Delete every resource tagged with the config's stack, dependents
+    first and independent resources concurrently."""
+    stack = config['stack']
+    start = time.monotonic()
+    with tracer.span('discover', category='phase'):
+        resources = await discover(clients, stack)
+    print_plan(stack, resources)
+    if plan_only or not resources:
+        return True
+
+    # Whatever the outcome, the cached inventory and the journal no longer
+    # match the account.
+    for path in (config['inventory_cache'], config['journal']):
+        if os.path.exists(path):
+            os.remove(path)
+    try:
+        await run_steps(build_steps(clients, resources, config['destroy_timeout']))
+        print(f"Stack {stack} destroyed in {time.monotonic() - start:.0f}s")
+        return True
+    except StepFailed as e:
+        print(f"Destroy failed: {e}")
+        return False
+    finally:
+        call_savings.report()
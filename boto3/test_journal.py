@@ -0,0 +1,85 @@
+import asyncio
+
+from executor import Step
+from inventory import Inventory
+from journal import Journal, fingerprint
+
+
+async def noop(**inputs):
+    return {}
+
+
+def make_step(name, provides=(), func=noop, requires=()):
+    return Step(name, func, requires=requires, provides=provides)
+
+
+def test_unfinished_is_empty_after_a_finished_run(tmp_path):
+    journal = Journal(str(tmp_path / 'journal.json'), planned=['network', 'key_pair'], finished=True)
+    assert journal.unfinished([make_step('network'), make_step('key_pair')]) == set()
+
+
+def test_unfinished_lists_planned_steps_the_failed_run_did_not_complete(tmp_path):
+    path = str(tmp_path / 'journal.json')
+    steps = [make_step('network'), make_step('key_pair'), make_step('fleet')]
+    journal = Journal(path)
+    journal.begin(steps[:2])
+    journal.record('network', 'digest', {})
+
+    resumed = Journal.load(path)
+    # fleet was not part of the failed run's plan, so it is not resumed.
+    assert resumed.unfinished(steps) == {'key_pair'}
+
+
+def test_restore_returns_outputs_for_unchanged_inputs(tmp_path):
+    step = make_step('key_pair', provides=('key_pair',))
+    journal = Journal(str(tmp_path / 'journal.json'),
+                      {'key_pair': {'inputs': 'abc', 'outputs': {'key_pair': 'sonal-instance'}}})
+    inventory = Inventory({'key_pairs': [{'KeyName': 'sonal-instance'}]})
+
+    assert journal.restore(step, 'abc', inventory) == {'key_pair': 'sonal-instance'}
+    assert journal.restore(step, 'changed', inventory) is None
+
+
+def test_restore_skips_resources_that_no_longer_exist(tmp_path):
+    step = make_step('fleet', provides=('fleet_instance_ids',))
+    journal = Journal(str(tmp_path / 'journal.json'),
+                      {'fleet': {'inputs': 'abc', 'outputs': {'fleet_instance_ids': ['i-1', 'i-2']}}})
+    inventory = Inventory({'instances': [{'InstanceId': 'i-1'}]})
+
+    assert journal.restore(step, 'abc', inventory) is None
+
+
+def test_wrap_records_outputs_and_restores_them_on_the_next_run(tmp_path):
+    path = str(tmp_path / 'journal.json')
+    calls = []
+
+    async def create_key_pair(key_pair_name):
+        calls.append(key_pair_name)
+        return {'key_pair': key_pair_name}
+
+    step = make_step('key_pair', provides=('key_pair',), func=create_key_pair, requires=('key_pair_name',))
+    inventory = Inventory({'key_pairs': [{'KeyName': 'sonal-instance'}]})
+
+    first = Journal(path)
+    assert asyncio.run(first.wrap(step, inventory).func(key_pair_name='sonal-instance')) == {'key_pair': 'sonal-instance'}
+    assert Journal.load(path).steps['key_pair']['inputs'] == fingerprint({'key_pair_name': 'sonal-instance'})
+
+    second = Journal.load(path)
+    assert asyncio.run(second.wrap(step, inventory).func(key_pair_name='sonal-instance')) == {'key_pair': 'sonal-instance'}
+    assert calls == ['sonal-instance']
+
+
+def test_wrap_runs_the_step_without_an_inventory(tmp_path):
+    calls = []
+
+    async def create_key_pair(key_pair_name):
+        calls.append(key_pair_name)
+        return {'key_pair': key_pair_name}
+
+    step = make_step('key_pair', provides=('key_pair',), func=create_key_pair, requires=('key_pair_name',))
+    journal = Journal(str(tmp_path / 'journal.json'),
+                      {'key_pair': {'inputs': fingerprint({'key_pair_name': 'sonal-instance'}),
+                                    'outputs': {'key_pair': 'sonal-instance'}}})
+
+    asyncio.run(journal.wrap(step).func(key_pair_name='sonal-instance'))
+    assert calls == ['sonal-instance']
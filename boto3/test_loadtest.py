@@ -0,0 +1,72 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from loadtest import DEFAULT_ROUTES, LoadTestError, load_test
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path == '/slow':
+            time.sleep(0.05)
+        status = 500 if self.path == '/broken' else 200
+        body = b'ok'
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub_port():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def settings(port, path, slo):
+    return {
+        'concurrency': 2,
+        'duration': 0.5,
+        'timeout': 2,
+        'routes': [{'name': path, 'target': 'instances', 'port': port, 'path': path}],
+        'slo': slo,
+    }
+
+
+def test_default_routes_only_read():
+    assert all(route.get('method', 'GET') == 'GET' for route in DEFAULT_ROUTES)
+
+
+def test_load_test_passes_within_slo(stub_port):
+    results = load_test({'instances': ['127.0.0.1']},
+                        settings(stub_port, '/health', {'p95_ms': 1000, 'max_error_rate': 0.0}))
+    assert len(results) == 1
+    assert results[0]['requests'] > 0
+    assert results[0]['errors'] == 0
+
+
+def test_load_test_fails_on_latency_breach(stub_port):
+    with pytest.raises(LoadTestError, match='p95'):
+        load_test({'instances': ['127.0.0.1']}, settings(stub_port, '/slow', {'p95_ms': 10}))
+
+
+def test_load_test_fails_on_errors(stub_port):
+    with pytest.raises(LoadTestError, match='failed'):
+        load_test({'instances': ['127.0.0.1']}, settings(stub_port, '/broken', {'max_error_rate': 0.01}))
+
+
+def test_load_test_needs_a_host_for_every_route(stub_port):
+    with pytest.raises(LoadTestError, match='No instances'):
+        load_test({'load_balancer': ['127.0.0.1']}, settings(stub_port, '/health', {}))
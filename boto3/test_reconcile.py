@@ -0,0 +1,244 @@
+import asyncio
+
+import pytest
+
+from bakes import bake_hash, bake_tags
+from executor import Step, StepFailed, run_steps
+from inventory import Inventory
+from reconcile import desired_state, diff
+from scaling import scaling_policies
+
+USER_DATA = '#!/bin/bash\n'
+BASE_AMI = 'ami-base'
+LB_ARN = 'arn:aws:elasticloadbalancing:ap-northeast-3:123456789012:loadbalancer/app/lb/1'
+TG_ARN = 'arn:aws:elasticloadbalancing:ap-northeast-3:123456789012:targetgroup/tg/2'
+
+CONFIG = {
+    'vpc_name': 'vpc',
+    'security_group_name': 'sg',
+    'required_ports': {22, 80},
+    'key_pair_name': 'key',
+    'ami_name': 'ami',
+    'user_data': USER_DATA,
+    'instance_type': 't3.micro',
+    'fleet_name': 'server',
+    'fleet_size': 2,
+    'target_group_name': 'tg',
+    'lb_name': 'lb',
+    'launch_template_name': 'lt',
+    'asg_name': 'asg',
+    'asg_capacity': {'min': 1, 'max': 4, 'desired': 1},
+    'scaling_targets': {'requests_per_target': 1000, 'cpu_percent': 50},
+    'warm_pool': None,
+}
+
+
+def named(name, **fields):
+    return dict(fields, Tags=[{'Key': 'Name', 'Value': name}])
+
+
+def deployed():
+    """Resources of a stack that matches CONFIG."""
+    digest = bake_hash(USER_DATA, BASE_AMI, CONFIG['instance_type'])
+    policies = scaling_policies('asg', LB_ARN, TG_ARN, CONFIG['scaling_targets'])
+    return {
+        'vpcs': [named('vpc', VpcId='vpc-1')],
+        'security_groups': [{'GroupId': 'sg-1', 'GroupName': 'sg', 'VpcId': 'vpc-1', 'IpPermissions': [
+            {'FromPort': port, 'ToPort': port} for port in (22, 80)
+        ]}],
+        'key_pairs': [{'KeyName': 'key'}],
+        'images': [{'ImageId': 'ami-1', 'Name': f'ami-{digest}', 'State': 'available',
+                    'Tags': [{'Key': key, 'Value': value}
+                             for key, value in bake_tags('ami', digest, BASE_AMI).items()]}],
+        'instances': [named('server', InstanceId=f'i-{index}', State={'Name': 'running'}) for index in range(2)],
+        'target_groups': [{'TargetGroupArn': TG_ARN, 'TargetGroupName': 'tg'}],
+        'load_balancers': [{'LoadBalancerArn': LB_ARN, 'LoadBalancerName': 'lb'}],
+        'listeners': [{'ListenerArn': 'listener-1', 'LoadBalancerArn': LB_ARN}],
+        'launch_templates': [{'LaunchTemplateId': 'lt-1', 'LaunchTemplateName': 'lt', 'DefaultVersionNumber': 2}],
+        'auto_scaling_groups': [{'AutoScalingGroupName': 'asg', 'MinSize': 1, 'MaxSize': 4,
+                                 'TargetGroupARNs': [TG_ARN],
+                                 'LaunchTemplate': {'LaunchTemplateId': 'lt-1', 'Version': '2'}}],
+        'scaling_policies': [{'PolicyName': name, 'AutoScalingGroupName': 'asg',
+                              'TargetTrackingConfiguration': configuration}
+                             for name, configuration in policies.items()],
+    }
+
+
+def plan_for(resources, **config):
+    return diff(desired_state(dict(CONFIG, **config)), Inventory(resources))
+
+
+def ops(plan):
+    return {action.kind: action.op for action in plan.actions}
+
+
+def test_empty_account_creates_everything():
+    plan = plan_for({})
+    assert ops(plan) == {
+        'vpc': 'create', 'security_group': 'create', 'key_pair': 'create', 'image': 'create',
+        'fleet': 'create', 'target_group': 'create', 'targets': 'update', 'load_balancer': 'create',
+        'listener': 'create', 'launch_template': 'create', 'auto_scaling_group': 'create',
+        'scaling_policies': 'create', 'warm_pool': 'noop',
+    }
+
+
+def test_deployed_stack_is_unchanged():
+    plan = plan_for(deployed())
+    assert plan.changes == []
+    assert plan.summary() == '0 to create, 0 to update, 13 unchanged'
+
+
+def test_security_group_ports_are_updated():
+    plan = plan_for(deployed(), required_ports={22, 443})
+    action = next(action for action in plan.actions if action.kind == 'security_group')
+    assert action.op == 'update'
+    assert action.detail == 'add ports [443], remove ports [80]'
+
+
+def test_missing_fleet_instances_are_launched_and_registered():
+    resources = deployed()
+    resources['instances'] = resources['instances'][:1]
+    plan = ops(plan_for(resources))
+    assert plan['fleet'] == 'update'
+    assert plan['targets'] == 'update'
+
+
+def test_stopped_fleet_instances_are_replaced():
+    resources = deployed()
+    resources['instances'][1]['State'] = {'Name': 'stopped'}
+    assert ops(plan_for(resources))['fleet'] == 'update'
+
+
+def test_changed_user_data_bakes_a_new_image():
+    assert ops(plan_for(deployed(), user_data='#!/bin/bash\necho changed\n'))['image'] == 'create'
+
+
+@pytest.mark.parametrize('state, op', [('pending', 'noop'), ('failed', 'create')])
+def test_failed_bakes_are_baked_again(state, op):
+    resources = deployed()
+    resources['images'][0]['State'] = state
+    assert ops(plan_for(resources))['image'] == op
+
+
+@pytest.mark.parametrize('kind, expected', [
+    ('key_pairs', {'key_pair': 'create'}),
+    ('target_groups', {'target_group': 'create', 'targets': 'update', 'auto_scaling_group': 'update',
+                       'scaling_policies': 'create'}),
+    ('load_balancers', {'load_balancer': 'create', 'listener': 'create', 'scaling_policies': 'create'}),
+    ('listeners', {'listener': 'create'}),
+    ('launch_templates', {'launch_template': 'create', 'auto_scaling_group': 'update'}),
+])
+def test_missing_resources_are_created(kind, expected):
+    resources = deployed()
+    resources[kind] = []
+    changes = {action.kind: action.op for action in plan_for(resources).changes}
+    assert changes == expected
+
+
+def test_auto_scaling_group_capacity_is_updated():
+    plan = plan_for(deployed(), asg_capacity={'min': 2, 'max': 6, 'desired': 2})
+    action = next(action for action in plan.actions if action.kind == 'auto_scaling_group')
+    assert (action.op, action.detail) == ('update', 'min 2, max 6')
+
+
+def test_auto_scaling_group_gets_the_target_group_attached():
+    resources = deployed()
+    resources['auto_scaling_groups'][0]['TargetGroupARNs'] = []
+    assert ops(plan_for(resources))['auto_scaling_group'] == 'update'
+
+
+def test_auto_scaling_group_moves_off_its_launch_configuration():
+    resources = deployed()
+    group = resources['auto_scaling_groups'][0]
+    del group['LaunchTemplate']
+    group['LaunchConfigurationName'] = 'MERNAppLaunchConfiguration'
+    plan = plan_for(resources)
+    action = next(action for action in plan.actions if action.kind == 'auto_scaling_group')
+    assert (action.op, action.detail) == ('update', 'move from launch configuration MERNAppLaunchConfiguration '
+                                                    'to launch template lt')
+
+
+def test_auto_scaling_group_moves_to_the_stack_launch_template():
+    resources = deployed()
+    resources['auto_scaling_groups'][0]['LaunchTemplate']['LaunchTemplateId'] = 'lt-other'
+    assert ops(plan_for(resources))['auto_scaling_group'] == 'update'
+
+
+@pytest.mark.parametrize('version', ['$Default', '$Latest', '1'])
+def test_auto_scaling_group_is_pinned_to_the_default_version_number(version):
+    resources = deployed()
+    resources['auto_scaling_groups'][0]['LaunchTemplate']['Version'] = version
+    plan = plan_for(resources)
+    action = next(action for action in plan.actions if action.kind == 'auto_scaling_group')
+    assert (action.op, action.detail) == ('update', 'launch template version 2')
+
+
+def test_changed_scaling_targets_update_the_policies():
+    plan = plan_for(deployed(), scaling_targets={'requests_per_target': 500, 'cpu_percent': 50})
+    action = next(action for action in plan.actions if action.kind == 'scaling_policies')
+    assert (action.op, action.detail) == ('update', 'asg-requests-per-target')
+
+
+def test_warm_pool_is_added_and_removed():
+    warm_pool = {'min_size': 1, 'pool_state': 'Stopped'}
+    assert ops(plan_for(deployed(), warm_pool=warm_pool))['warm_pool'] == 'update'
+
+    resources = deployed()
+    resources['auto_scaling_groups'][0]['WarmPoolConfiguration'] = {'MinSize': 1, 'PoolState': 'Stopped'}
+    assert ops(plan_for(resources, warm_pool=warm_pool))['warm_pool'] == 'noop'
+    assert ops(plan_for(resources))['warm_pool'] == 'update'
+
+
+def make_step(name, requires=(), provides=(), calls=None, fail=False):
+    async def func(**inputs):
+        if calls is not None:
+            calls.append(name)
+        if fail:
+            raise StepFailed(f"{name} broke")
+        return {key: name for key in provides}
+
+    return Step(name, func, requires, provides)
+
+
+STEPS = [
+    make_step('network', provides=('vpc_id',)),
+    make_step('subnets', requires=('vpc_id',), provides=('subnet_ids',)),
+    make_step('key_pair', provides=('key_pair',)),
+    make_step('load_balancer', requires=('subnet_ids',), provides=('load_balancer_arn',)),
+    make_step('listener', requires=('load_balancer_arn',), provides=('listener_arn',)),
+]
+
+
+def test_prune_steps_keeps_the_providers_of_a_changed_step():
+    resources = deployed()
+    resources['listeners'] = []
+    kept = plan_for(resources).prune_steps(STEPS)
+    assert [step.name for step in kept] == ['network', 'subnets', 'load_balancer', 'listener']
+
+
+def test_prune_steps_keeps_included_steps():
+    kept = plan_for(deployed()).prune_steps(STEPS, include={'key_pair'})
+    assert [step.name for step in kept] == ['key_pair']
+
+
+def test_run_steps_passes_outputs_along():
+    context = asyncio.run(run_steps(STEPS, context={'stack': 'test'}))
+    assert context['listener_arn'] == 'listener'
+    assert context['stack'] == 'test'
+
+
+def test_run_steps_skips_the_remaining_steps_after_a_failure():
+    calls = []
+    steps = [
+        make_step('network', provides=('vpc_id',), calls=calls, fail=True),
+        make_step('subnets', requires=('vpc_id',), provides=('subnet_ids',), calls=calls),
+        make_step('load_balancer', requires=('subnet_ids',), provides=('load_balancer_arn',), calls=calls),
+    ]
+    with pytest.raises(StepFailed, match='Failed steps: network; skipped: subnets, load_balancer'):
+        asyncio.run(run_steps(steps))
+    assert calls == ['network']
+
+
+def test_run_steps_rejects_a_step_nobody_provides_for():
+    with pytest.raises(ValueError, match='requires vpc_id'):
+        asyncio.run(run_steps([make_step('subnets', requires=('vpc_id',), provides=('subnet_ids',))]))
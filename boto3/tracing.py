@@ -0,0 +1,234 @@
+import asyncio
+import heapq
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+THROTTLING_CODES = {
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestLimitExceeded',
+    'RequestThrottled',
+    'RequestThrottledException',
+    'TooManyRequestsException',
+    'SlowDown',
+}
+
+
+def _error_code(parsed):
+    return (parsed or {}).get('Error', {}).get('Code')
+
+
+def _response_size(http_response):
+    if http_response is None:
+        return 0
+    content = http_response.content
+    if content is None or isinstance(content, bytes):
+        return len(content or b'')
+    # aiobotocore hands the body out as a coroutine; the header will do.
+    content.close()
+    return int(http_response.headers.get('content-length') or 0)
+
+
+# (track, owner) of the innermost open span in the current context.
+_open_span = ContextVar('trace_span', default=None)
+
+
+def _owner():
+    """The task, or else the thread, that a span is running in."""
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    return task or threading.get_ident()
+
+
+class Tracer:
+    """Records every AWS call made through instrumented clients and named
+    spans around higher level work, for a Chrome trace and a summary.
+
+    Steps run concurrently on one event loop, so each span and call gets a
+    track of its own rather than its thread's: a track is only reused once
+    the span or call on it has ended, and a span nested in another span of
+    the same task shares its track, so every track nests as Chrome and
+    Perfetto expect."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._handlers = []
+        self.reset()
+
+    def reset(self):
+        self.origin = time.monotonic()
+        self.calls = []
+        self.spans = []
+        self._free_tracks = []
+        self._tracks = 0
+
+    def _acquire_track(self):
+        with self._lock:
+            if self._free_tracks:
+                return heapq.heappop(self._free_tracks)
+            self._tracks += 1
+            return self._tracks
+
+    def _release_track(self, track):
+        with self._lock:
+            heapq.heappush(self._free_tracks, track)
+
+    def _offset(self, moment):
+        return moment - self.origin
+
+    def instrument(self, client):
+        service = client.meta.service_model.service_name
+        region = client.meta.region_name
+
+        def before_call(model, context, **kwargs):
+            context['trace_start'] = time.monotonic()
+            context['trace_throttles'] = 0
+            context['trace_track'] = self._acquire_track()
+
+        def needs_retry(response, request_dict, **kwargs):
+            if response is not None and _error_code(response[1]) in THROTTLING_CODES:
+                context = request_dict.get('context', {})
+                context['trace_throttles'] = context.get('trace_throttles', 0) + 1
+
+        def after_call(http_response, parsed, model, context, **kwargs):
+            self._record(service, region, model.name, context,
+                         error=_error_code(parsed),
+                         retries=parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0),
+                         size=_response_size(http_response))
+
+        def after_call_error(event_name, context, exception, **kwargs):
+            # This event carries no operation model; the name ends the event.
+            operation = event_name.rsplit('.', 1)[-1]
+            self._record(service, region, operation, context, error=type(exception).__name__, retries=0, size=0)
+
+        handlers = [
+            ('before-call.*.*', before_call),
+            ('needs-retry.*.*', needs_retry),
+            ('after-call.*.*', after_call),
+            ('after-call-error.*.*', after_call_error),
+        ]
+        for event_name, handler in handlers:
+            client.meta.events.register(event_name, handler)
+        self._handlers.append((client, handlers))
+
+    def uninstrument(self, client):
+        for instrumented, handlers in list(self._handlers):
+            if instrumented is client:
+                for event_name, handler in handlers:
+                    client.meta.events.unregister(event_name, handler)
+                self._handlers.remove((instrumented, handlers))
+
+    def _record(self, service, region, operation, context, error, retries, size):
+        end = time.monotonic()
+        start = context.get('trace_start', end)
+        throttles = context.get('trace_throttles', 0) + (1 if error in THROTTLING_CODES else 0)
+        track = context.pop('trace_track', None)
+        if track is not None:
+            self._release_track(track)
+        with self._lock:
+            self.calls.append({
+                'service': service,
+                'region': region,
+                'operation': operation,
+                'start': self._offset(start),
+                'duration': end - start,
+                'retries': retries,
+                'throttles': throttles,
+                'error': error,
+                'bytes': size,
+                'track': track or 0,
+            })
+
+    @contextmanager
+    def span(self, name, category='step', **args):
+        owner = _owner()
+        parent = _open_span.get()
+        nested = parent is not None and parent[1] == owner
+        track = parent[0] if nested else self._acquire_track()
+        token = _open_span.set((track, owner))
+        start = time.monotonic()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            end = time.monotonic()
+            _open_span.reset(token)
+            if not nested:
+                self._release_track(track)
+            with self._lock:
+                self.spans.append({
+                    'name': name,
+                    'category': category,
+                    'start': self._offset(start),
+                    'duration': end - start,
+                    'error': error,
+                    'args': args,
+                    'track': track,
+                })
+
+    def chrome_trace(self):
+        pid = os.getpid()
+        events = []
+        for span in self.spans:
+            events.append({
+                'name': span['name'], 'cat': span['category'], 'ph': 'X', 'pid': pid, 'tid': span['track'],
+                'ts': span['start'] * 1e6, 'dur': span['duration'] * 1e6,
+                'args': dict(span['args'], error=span['error']),
+            })
+        for call in self.calls:
+            events.append({
+                'name': f"{call['service']}.{call['operation']}", 'cat': 'aws', 'ph': 'X', 'pid': pid,
+                'tid': call['track'], 'ts': call['start'] * 1e6, 'dur': call['duration'] * 1e6,
+                'args': {key: call[key] for key in ('region', 'retries', 'throttles', 'error', 'bytes')},
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write(self, path):
+        with open(path, 'w') as trace_file:
+            json.dump(self.chrome_trace(), trace_file)
+        print(f"Trace with {len(self.spans)} spans and {len(self.calls)} API calls written to {path}")
+
+    def operation_stats(self):
+        stats = {}
+        for call in self.calls:
+            key = f"{call['service']}.{call['operation']}"
+            entry = stats.setdefault(key, {'calls': 0, 'total': 0.0, 'max': 0.0, 'retries': 0,
+                                           'throttles': 0, 'errors': 0, 'bytes': 0})
+            entry['calls'] += 1
+            entry['total'] += call['duration']
+            entry['max'] = max(entry['max'], call['duration'])
+            entry['retries'] += call['retries']
+            entry['throttles'] += call['throttles']
+            entry['errors'] += 1 if call['error'] else 0
+            entry['bytes'] += call['bytes']
+        return stats
+
+    def summary(self, top=10):
+        steps = sorted((span for span in self.spans if span['category'] == 'step'),
+                       key=lambda span: span['duration'], reverse=True)
+        if steps:
+            print("Slowest steps:")
+            print(f"  {'step':<32}{'seconds':>10}")
+            for span in steps[:top]:
+                print(f"  {span['name']:<32}{span['duration']:>10.2f}")
+
+        stats = sorted(self.operation_stats().items(), key=lambda item: item[1]['total'], reverse=True)
+        if stats:
+            print(f"Slowest API calls ({len(self.calls)} calls in total):")
+            print(f"  {'operation':<48}{'calls':>6}{'total s':>9}{'max s':>8}{'retries':>8}{'throttled':>10}{'KiB':>8}")
+            for name, entry in stats[:top]:
+                print(f"  {name:<48}{entry['calls']:>6}{entry['total']:>9.2f}{entry['max']:>8.2f}"
+                      f"{entry['retries']:>8}{entry['throttles']:>10}{entry['bytes'] / 1024:>8.1f}")
+
+
+tracer = Tracer()
@@ -0,0 +1,157 @@
+import base64
+import gzip
+import hashlib
+import json
+import os
+import shlex
+from collections import namedtuple
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import yaml
+
+from readiness import USER_DATA_DONE_MARKER, USER_DATA_FAILED_MARKER
+
+VALUES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mern-app', 'values.yaml')
+
+# EC2 rejects user data over 16 KB, counted before base64 encoding.
+USER_DATA_LIMIT = 16 * 1024
+
+# A fixed boundary and gzip mtime keep the rendered bytes, and so the bake
+# hash of the AMI built from them, the same from one run to the next.
+BOUNDARY = 'MERN-USER-DATA'
+ENV_DIR = '/etc/mern'
+
+Service = namedtuple('Service', ['name', 'image', 'port', 'env'])
+
+CLOUD_CONFIG = {
+    'package_update': True,
+    'packages': ['docker.io'],
+}
+
+BOOTSTRAP = """#!/bin/bash
+trap 'echo {failed} > /dev/console' ERR
+set -euo pipefail
+systemctl enable --now docker
+
+# Pull every image at once; docker fetches the layers they share only once.
+pids=()
+{pulls}
+for pid in "${{pids[@]}}"; do wait "$pid"; done
+
+{runs}
+echo {done} > /dev/console
+"""
+
+PULL = 'docker pull {image} & pids+=($!)'
+
+RUN = ('docker rm -f {name} >/dev/null 2>&1 || true\n'
+       'docker run -d --name {name} --restart unless-stopped --env-file {env_file} -p {port}:{port} {image}')
+
+
+def load_services(values_path=VALUES_PATH, env=None):
+    """The services in the Helm chart's ``values.yaml``, in name order, with
+    ``env`` (service name -> variables) added to each. Every service gets
+    ``PORT``, as it does in the chart. Raises ``ValueError`` if a variable is
+    None, e.g. MONGO_URL missing from the environment, rather than rendering
+    a service that cannot start."""
+    with open(values_path) as values_file:
+        values = yaml.safe_load(values_file)
+    services = []
+    for name, settings in sorted(values.items()):
+        variables = {'PORT': str(settings['port'])}
+        for key, value in (env or {}).get(name, {}).items():
+            if value is None:
+                raise ValueError(f"{key} is not set for service {name}; set it in the environment or in service_env")
+            variables[key] = str(value)
+        services.append(Service(name, settings['image'], settings['port'], variables))
+    return services
+
+
+def env_file(service):
+    return f'{ENV_DIR}/{service.name}.env'
+
+
+def cloud_config(services):
+    # Environment files keep values such as MONGO_URL out of the process
+    # list and away from shell quoting.
+    config = dict(CLOUD_CONFIG, write_files=[
+        {
+            'path': env_file(service),
+            'permissions': '0600',
+            'content': ''.join(f'{key}={value}\n' for key, value in sorted(service.env.items())),
+        }
+        for service in services
+    ])
+    return '#cloud-config\n' + yaml.safe_dump(config, sort_keys=True)
+
+
+def bootstrap_script(services):
+    return BOOTSTRAP.format(
+        failed=USER_DATA_FAILED_MARKER,
+        done=USER_DATA_DONE_MARKER,
+        pulls='\n'.join(PULL.format(image=shlex.quote(service.image)) for service in services),
+        runs='\n'.join(RUN.format(name=shlex.quote(service.name), env_file=env_file(service), port=service.port,
+                                  image=shlex.quote(service.image))
+                       for service in services),
+    )
+
+
+def render_user_data(services):
+    """Gzip-compressed multipart cloud-init: a cloud-config part that installs
+    Docker and writes each service's environment, then a script that pulls
+    the images in parallel and starts the containers."""
+    message = MIMEMultipart(boundary=BOUNDARY)
+    for content, subtype, filename in ((cloud_config(services), 'cloud-config', 'cloud-config.yaml'),
+                                       (bootstrap_script(services), 'x-shellscript', 'bootstrap.sh')):
+        part = MIMEText(content, subtype)
+        part.add_header('Content-Disposition', 'attachment', filename=filename)
+        message.attach(part)
+    user_data = gzip.compress(message.as_bytes(), mtime=0)
+    if len(user_data) > USER_DATA_LIMIT:
+        raise ValueError(f"User data is {len(user_data)} bytes, over the {USER_DATA_LIMIT} byte limit")
+    return user_data
+
+
+def content_hash(services):
+    """Fingerprint of the services and of the templates they are rendered
+    with."""
+    digest = hashlib.sha256()
+    digest.update(json.dumps([service._asdict() for service in services], sort_keys=True).encode())
+    for template in (json.dumps(CLOUD_CONFIG, sort_keys=True), BOOTSTRAP, PULL, RUN, BOUNDARY, ENV_DIR):
+        digest.update(b'\0')
+        digest.update(template.encode())
+    return digest.hexdigest()[:16]
+
+
+def build_user_data(services, cache_dir=None):
+    """``render_user_data(services)``, reusing the copy in ``cache_dir`` when
+    one was rendered from the same content before."""
+    if cache_dir is None:
+        return render_user_data(services)
+    path = os.path.join(cache_dir, f'{content_hash(services)}.gz')
+    try:
+        with open(path, 'rb') as cached:
+            return cached.read()
+    except OSError:
+        pass
+    user_data = render_user_data(services)
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    temporary = f'{path}.tmp'
+    # The rendered env files hold secrets such as MONGO_URL, so the cache is
+    # only readable by its owner, like the env files on the instance.
+    descriptor = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.fchmod(descriptor, 0o600)
+    with open(descriptor, 'wb') as cache_file:
+        cache_file.write(user_data)
+    os.replace(temporary, path)
+    print(f"User data rendered for {', '.join(service.name for service in services)}: {len(user_data)} bytes")
+    return user_data
+
+
+def encode_user_data(user_data):
+    """User data as launch templates take it: base64 text. Accepts the
+    rendered bytes or a plain script."""
+    if isinstance(user_data, str):
+        user_data = user_data.encode()
+    return base64.b64encode(user_data).decode()